@@ -4,10 +4,14 @@ from flask import Flask
 from flask_cors import CORS
 from flask_pymongo import PyMongo
 from flask_login import LoginManager
+from pymongo.read_preferences import ReadPreference
 import logging
 
+from .config import Config
+from . import metrics
+
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=Config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
 # Initialize Flask app
@@ -15,7 +19,6 @@ app = Flask(__name__, template_folder='../templates')
 CORS(app)
 
 # Load configuration
-from .config import Config
 app.config['SECRET_KEY'] = Config.SECRET_KEY
 app.config['MONGO_URI'] = Config.MONGODB_URI
 
@@ -23,18 +26,40 @@ app.config['MONGO_URI'] = Config.MONGODB_URI
 mongo = PyMongo()
 login_manager = LoginManager()
 
-try:
-    # Initialize MongoDB
-    mongo.init_app(app)
-    # Test connection
-    mongo.db.command('ping')
-    logger.info("Successfully connected to MongoDB")
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB: {str(e)}")
-    # Don't set mongo to None, keep the PyMongo instance
+# The client is created once per worker and, in lazy mode, doesn't open a
+# connection until the first query, so cold starts don't wait on the
+# network. A short server selection timeout makes requests fail fast when
+# the database is unreachable instead of hanging for the driver default.
+mongo.init_app(app, event_listeners=[metrics.command_timer], **Config.mongo_client_options())
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST
+}
+
+def secondary_collection(name):
+    # Handle for reads that can tolerate replication lag, such as the
+    # leaderboard and the playmaker's lists, so they can be served by secondaries
+    read_preference = READ_PREFERENCES[Config.MONGO_SECONDARY_READ_PREFERENCE]
+    return mongo.db.get_collection(name, read_preference=read_preference)
+
+if not Config.MONGO_LAZY_CONNECT:
+    try:
+        # Test connection
+        mongo.db.command('ping')
+        logger.info("Successfully connected to MongoDB")
+    except Exception as e:
+        logger.error(f"Failed to connect to MongoDB: {str(e)}")
 
 # Initialize login manager
 login_manager.init_app(app)
 
+# Per-request latency, Mongo command and render timing
+metrics.init_app(app)
+
 from . import models  # Import models after app initialization
-from . import index   # Import views after app initialization 
\ No newline at end of file
+from . import index   # Import views after app initialization
+from . import v1      # Versioned JSON API, uses helpers from index 
\ No newline at end of file
@@ -0,0 +1,222 @@
+# Rater accuracy across an event. Streams the ratings collection into NumPy
+# arrays a batch at a time, then computes every statistic with array
+# operations, so millions of ratings take seconds. NumPy is optional and
+# only needed by this module:
+#
+#   pip install numpy
+#   python -m api.analytics --limit 20
+#
+# The same report is served to playmakers at /api/v1/analytics.
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+
+from . import mongo, secondary_collection
+from .catalog import catalog
+from .config import Config
+from .tombstones import tombstones
+from .utils import serialize_doc
+
+logger = logging.getLogger(__name__)
+
+# Points for one rating as a function of the absolute difference from the
+# playmaker's rating. 'current' is utils.calculate_points; the others show
+# how the leaderboard would look under a different rule.
+SCORING = {
+    'current': lambda difference: np.maximum(0, 10 - np.floor(difference * 2)),
+    'linear': lambda difference: np.maximum(0, 10 - difference * 2),
+    'gaussian': lambda difference: 10 * np.exp(-difference * difference / 4.5),
+    'banded': lambda difference: np.select([difference <= 0.5, difference <= 1.5, difference <= 3], [10, 6, 2], 0)
+}
+
+class RatingArrays:
+    # One entry per rating. Users and samples are numbered in the order they
+    # are first seen, so per-user and per-sample totals are bincounts.
+    def __init__(self, user_ids, sample_ids, user_index, sample_index, values, targets):
+        self.user_ids = user_ids
+        self.sample_ids = sample_ids
+        self.user_index = user_index
+        self.sample_index = sample_index
+        self.values = values
+        self.targets = targets
+
+    def __len__(self):
+        return len(self.values)
+
+def load_ratings(batch_size=None):
+    # Ratings of samples no longer in the catalog have nothing to compare
+    # against and are left out, as are those of tombstoned users
+    targets = {sample['_id']: sample['playmaker_rating'] for sample in catalog.all()}
+    user_codes = {}
+    sample_codes = {}
+    chunks = []
+    batch = []
+
+    def flush():
+        chunks.append((
+            np.fromiter((user_codes.setdefault(doc['user_id'], len(user_codes)) for doc in batch), np.int32, len(batch)),
+            np.fromiter((sample_codes.setdefault(doc['sample_id'], len(sample_codes)) for doc in batch), np.int32, len(batch)),
+            np.fromiter((doc['rating_value'] for doc in batch), np.float64, len(batch)),
+            np.fromiter((targets[doc['sample_id']] for doc in batch), np.float64, len(batch))
+        ))
+        batch.clear()
+
+    batch_size = batch_size or Config.ANALYTICS_BATCH_SIZE
+    cursor = secondary_collection('ratings').find(
+        tombstones.visible_ratings({}),
+        {'_id': 0, 'user_id': 1, 'sample_id': 1, 'rating_value': 1}
+    ).batch_size(batch_size)
+    for doc in cursor:
+        if doc.get('sample_id') in targets:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                flush()
+    if batch or not chunks:
+        flush()
+
+    return RatingArrays(
+        list(user_codes),
+        list(sample_codes),
+        *(np.concatenate(column) for column in zip(*chunks))
+    )
+
+def group_stats(index, size, error):
+    # Count, mean absolute error, bias (mean signed error, positive when
+    # rating above the playmaker) and consistency (standard deviation of the
+    # error, lower is steadier) for every group at once
+    count = np.bincount(index, minlength=size)
+    safe = np.maximum(count, 1)
+    bias = np.bincount(index, error, size) / safe
+    mean_square = np.bincount(index, error * error, size) / safe
+    return {
+        'count': count,
+        'mae': np.bincount(index, np.abs(error), size) / safe,
+        'bias': bias,
+        'consistency': np.sqrt(np.maximum(mean_square - bias * bias, 0))
+    }
+
+def competition_ranks(points):
+    # 1 + the number of strictly higher totals, like Leaderboard.rank
+    descending = -np.sort(points)[::-1]
+    return np.searchsorted(descending, -points, side='left') + 1
+
+def analyze(ratings):
+    error = ratings.values - ratings.targets
+    difference = np.abs(error)
+    users = group_stats(ratings.user_index, len(ratings.user_ids), error)
+    samples = group_stats(ratings.sample_index, len(ratings.sample_ids), error)
+    samples['mean_rating'] = (np.bincount(ratings.sample_index, ratings.values, len(ratings.sample_ids))
+                              / np.maximum(samples['count'], 1))
+
+    users['points'] = {}
+    users['rank'] = {}
+    for name, score in SCORING.items():
+        points = np.bincount(ratings.user_index, score(difference), len(ratings.user_ids))
+        users['points'][name] = points
+        users['rank'][name] = competition_ranks(points)
+
+    return {
+        'ratings': len(ratings),
+        'mae': float(difference.mean()) if len(ratings) else None,
+        'bias': float(error.mean()) if len(ratings) else None,
+        'users': users,
+        'samples': samples
+    }
+
+def rounded(value):
+    return round(float(value), 3)
+
+def report(limit=None, batch_size=None):
+    # Users sorted from most to least accurate, samples from most to least
+    # contested, each cut to limit entries
+    started = time.perf_counter()
+    ratings = load_ratings(batch_size)
+    loaded = time.perf_counter()
+    result = analyze(ratings)
+    analyzed = time.perf_counter()
+
+    users = result['users']
+    usernames = {
+        user['_id']: user['username']
+        for user in mongo.db.users.find({'_id': {'$in': ratings.user_ids}}, {'username': 1})
+    }
+    user_rows = [
+        {
+            'id': user_id,
+            'username': usernames.get(user_id, 'Unknown User'),
+            'ratings': int(users['count'][i]),
+            'mae': rounded(users['mae'][i]),
+            'bias': rounded(users['bias'][i]),
+            'consistency': rounded(users['consistency'][i]),
+            'points': {name: rounded(points[i]) for name, points in users['points'].items()},
+            'rank': {name: int(ranks[i]) for name, ranks in users['rank'].items()}
+        }
+        for i, user_id in enumerate(ratings.user_ids)
+    ]
+    user_rows.sort(key=lambda row: (row['mae'], -row['ratings']))
+
+    samples = result['samples']
+    sample_rows = []
+    for i, sample_id in enumerate(ratings.sample_ids):
+        sample = catalog.get(sample_id) or {}
+        sample_rows.append({
+            'id': sample_id,
+            'name': sample.get('name', 'Unknown Sample'),
+            'playmaker_rating': sample.get('playmaker_rating'),
+            'ratings': int(samples['count'][i]),
+            'mean_rating': rounded(samples['mean_rating'][i]),
+            'mae': rounded(samples['mae'][i]),
+            'bias': rounded(samples['bias'][i]),
+            'consistency': rounded(samples['consistency'][i])
+        })
+    sample_rows.sort(key=lambda row: -row['consistency'])
+
+    return serialize_doc({
+        'summary': {
+            'ratings': result['ratings'],
+            'users': len(user_rows),
+            'samples': len(sample_rows),
+            'mae': None if result['mae'] is None else rounded(result['mae']),
+            'bias': None if result['bias'] is None else rounded(result['bias']),
+            'formulas': list(SCORING),
+            'load_seconds': rounded(loaded - started),
+            'analyze_seconds': rounded(analyzed - loaded)
+        },
+        'users': user_rows[:limit],
+        'samples': sample_rows[:limit]
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description='Rater accuracy report for the Rating Meter event')
+    parser.add_argument('--limit', type=int, default=20, help='users and samples to list')
+    parser.add_argument('--batch-size', type=int, default=Config.ANALYTICS_BATCH_SIZE)
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    args = parser.parse_args()
+
+    result = report(args.limit, args.batch_size)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    summary = result['summary']
+    print(f"{summary['ratings']} ratings by {summary['users']} players on {summary['samples']} samples, "
+          f"loaded in {summary['load_seconds']:.2f} s, analyzed in {summary['analyze_seconds']:.3f} s")
+    print(f"overall mean absolute error {summary['mae']}, bias {summary['bias']}")
+    print()
+    print(f"{'player':<20}{'ratings':>8}{'mae':>8}{'bias':>8}{'spread':>8}"
+          + ''.join(f'{name:>10}' for name in summary['formulas']))
+    for row in result['users']:
+        print(f"{row['username'][:19]:<20}{row['ratings']:>8}{row['mae']:>8.2f}{row['bias']:>8.2f}"
+              f"{row['consistency']:>8.2f}"
+              + ''.join(f"{row['points'][name]:>7.0f} #{row['rank'][name]:<2}" for name in summary['formulas']))
+    print()
+    print(f"{'sample':<24}{'ratings':>8}{'playmaker':>10}{'mean':>8}{'mae':>8}{'bias':>8}{'spread':>8}")
+    for row in result['samples']:
+        print(f"{row['name'][:23]:<24}{row['ratings']:>8}{row['playmaker_rating']:>10.1f}{row['mean_rating']:>8.2f}"
+              f"{row['mae']:>8.2f}{row['bias']:>8.2f}{row['consistency']:>8.2f}")
+
+if __name__ == '__main__':
+    main()
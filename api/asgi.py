@@ -0,0 +1,349 @@
+# Optional async serving mode. The read routes that query MongoDB on every
+# request (the dashboards and the JSON APIs) are served here with Motor, so
+# one worker keeps many of them in flight while it waits on the database.
+# Every other route, including all writes, is handed to the regular Flask
+# app unchanged. Needs packages that the WSGI deployment doesn't:
+#
+#   pip install motor==2.5.1 asgiref==3.4.1 uvicorn==0.15.0
+#   uvicorn api.asgi:application --workers 1
+#
+# Motor 2.5 is the last release that works with pymongo 3.12, and it only
+# runs on Python 3.6 to 3.10 (it imports asyncio.coroutine, which 3.11
+# removed). The Vercel runtime is python3.9; on a newer Python this module
+# fails to import with a message saying so.
+#
+# Async views run inside a Flask request context, so sessions, flashed
+# messages, current_user, templates and the after_request hooks behave as
+# they do under WSGI. Only their queries change. Event streams are served
+# on the loop too, so an open stream doesn't hold a thread, and the routes
+# left to Flask run on a pool of ASGI_WSGI_THREADS. The in-process caches
+# (catalog, leaderboard, versions, users) still reload with pymongo, which
+# briefly blocks the loop once per TTL.
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import logging
+import sys
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from bson import ObjectId
+from flask import render_template, request, redirect, url_for, flash, session, jsonify, Response
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError as e:
+    raise ImportError(f"Async mode needs motor 2.5 on Python 3.10 or older: {e}") from e
+
+from . import app, login_manager, READ_PREFERENCES
+from . import events
+from . import metrics
+from . import stats
+from . import v1
+from .catalog import catalog
+from .config import Config
+from .index import event_channels, EVENT_STREAM_HEADERS
+from .models import User, user_cache
+from .queries import (split_page, samples_page, with_stats, ratings_page_pipeline, own_ratings_page_pipeline,
+                      players_page_find, player_ratings_pipeline, unrated_samples)
+from .tombstones import NOT_DELETED
+from .utils import serialize_doc, parse_page_args, validate_object_id
+from .versions import versions
+
+logger = logging.getLogger(__name__)
+
+wsgi_executor = ThreadPoolExecutor(Config.ASGI_WSGI_THREADS, thread_name_prefix='wsgi')
+
+class WsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI request on one shared thread by default, so a
+    # single slow response would queue all the others behind it
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False,
+                                 executor=wsgi_executor)
+
+class Wsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await WsgiInstance(self.wsgi_application)(scope, receive, send)
+
+flask_app = Wsgi(app)
+
+# Streams cost nothing but a queue here, so leaderboard pages subscribe
+app.jinja_env.globals['events_streaming'] = True
+
+_client = None
+
+def motor_db():
+    # Created on first use so it binds to the server's event loop
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(Config.MONGODB_URI, event_listeners=[metrics.command_timer],
+                                     **Config.mongo_client_options())
+    return _client.get_default_database()
+
+def collection(name, secondary=False):
+    if secondary:
+        read_preference = READ_PREFERENCES[Config.MONGO_SECONDARY_READ_PREFERENCE]
+        return motor_db().get_collection(name, read_preference=read_preference)
+    return motor_db()[name]
+
+async def load_session_user():
+    # Flask-Login's user_loader reads user_cache first, so fetching a missing
+    # user here keeps its pymongo find_one off the event loop
+    user_id = session.get('_user_id')
+    if user_id and user_cache.get(user_id) is None and ObjectId.is_valid(user_id):
+        user_data = await collection('users').find_one({'_id': ObjectId(user_id), **NOT_DELETED})
+        if user_data:
+            User(user_data).remember()
+
+async def conditional_json(etag, build, public=False):
+    # v1.conditional_json, awaiting the body only when the client's copy is stale
+    body = None if request.if_none_match.contains(etag) else await build()
+    return v1.conditional_json(etag, lambda: body, public)
+
+# Dashboard lists, as in index.py
+
+async def get_samples_page(before, limit):
+    docs, next_cursor = samples_page(catalog.all(), before, limit)
+    sample_ids = [s['_id'] for s in docs]
+    found = await collection('sample_stats').find(stats.stats_query(sample_ids)).to_list(None)
+    return with_stats(docs, stats.summaries(sample_ids, found)), next_cursor
+
+async def get_ratings_page(before, limit):
+    docs = await collection('ratings', secondary=True).aggregate(ratings_page_pipeline(before, limit)).to_list(None)
+    return split_page(catalog.attach(docs), limit)
+
+async def get_players_page(before, limit):
+    return split_page(await collection('users', secondary=True).find(**players_page_find(before, limit)).to_list(None), limit)
+
+async def get_own_ratings_page(user_id, before, limit):
+    docs = await collection('ratings').aggregate(own_ratings_page_pipeline(user_id, before, limit)).to_list(None)
+    return split_page(catalog.attach(docs), limit)
+
+DASHBOARD_PAGES = {
+    'samples': get_samples_page,
+    'ratings': get_ratings_page,
+    'users': get_players_page
+}
+
+# Views
+
+async def dashboard():
+    if not current_user.is_authenticated:
+        return login_manager.unauthorized()
+    try:
+        if current_user.is_playmaker:
+            # The three lists are independent, so their queries run concurrently
+            page_size = Config.DASHBOARD_PAGE_SIZE
+            (samples, samples_next), (ratings, ratings_next), (users, users_next) = await asyncio.gather(
+                get_samples_page(None, page_size),
+                get_ratings_page(None, page_size),
+                get_players_page(None, page_size)
+            )
+            return render_template('playmaker_dashboard.html',
+                                   samples=samples,
+                                   ratings=ratings,
+                                   users=users,
+                                   samples_next=samples_next,
+                                   ratings_next=ratings_next,
+                                   users_next=users_next,
+                                   user=current_user)
+
+        pipeline = player_ratings_pipeline(ObjectId(current_user.get_id()))
+        ratings = catalog.attach(await collection('ratings').aggregate(pipeline).to_list(None), require_sample=True)
+        return render_template('player_dashboard.html',
+                               samples=unrated_samples(catalog.all(), ratings),
+                               ratings=ratings,
+                               user=current_user)
+    except Exception as e:
+        logger.error(f"Dashboard error: {str(e)}")
+        logger.exception("Full traceback:")
+        flash('Error loading dashboard. Please try again.')
+        return redirect(url_for('index'))
+
+async def dashboard_page(kind):
+    if not current_user.is_authenticated:
+        return login_manager.unauthorized()
+    if not current_user.is_playmaker:
+        return jsonify({'status': 'error', 'message': 'Only playmakers can view this data'}), 403
+    if kind not in DASHBOARD_PAGES:
+        return jsonify({'status': 'error', 'message': f'Unknown list: {kind}'}), 404
+
+    before, limit = parse_page_args(request.args, Config.DASHBOARD_PAGE_SIZE, Config.MAX_PAGE_SIZE)
+    items, next_cursor = await DASHBOARD_PAGES[kind](before, limit)
+    return jsonify({
+        'status': 'success',
+        'items': serialize_doc(items),
+        'next': next_cursor
+    })
+
+async def api_ratings():
+    if not current_user.is_authenticated:
+        return v1.unauthorized()
+    before, limit = parse_page_args(request.args, Config.DASHBOARD_PAGE_SIZE, Config.MAX_PAGE_SIZE)
+    scope = 'playmaker' if current_user.is_playmaker else current_user.id
+
+    async def build():
+        if current_user.is_playmaker:
+            items, next_cursor = await get_ratings_page(before, limit)
+        else:
+            items, next_cursor = await get_own_ratings_page(ObjectId(current_user.id), before, limit)
+        return {'status': 'success', 'items': serialize_doc(items), 'next': next_cursor}
+
+    return await conditional_json(versions.etag('ratings', 'users', 'samples', scope=scope), build)
+
+async def api_user_stats(user_id):
+    if not current_user.is_authenticated:
+        return v1.unauthorized()
+    if user_id != current_user.id and not current_user.is_playmaker:
+        return v1.forbidden('Players can only view their own stats')
+    user_obj_id = validate_object_id(user_id)
+    if not user_obj_id:
+        return jsonify({'status': 'error', 'message': 'Invalid user id'}), 400
+
+    async def build():
+        user, totals = await asyncio.gather(
+            collection('users').find_one({'_id': user_obj_id, **NOT_DELETED}, v1.USER_STATS_FIELDS),
+            collection('ratings').aggregate(v1.user_totals_pipeline(user_obj_id)).to_list(None)
+        )
+        return v1.user_stats(user_id, user, totals)
+
+    return await conditional_json(versions.etag('users', 'ratings', scope=user_id), build)
+
+async def event_stream():
+    channels, error = event_channels()
+    if error:
+        return error
+    subscriber = events.publisher.subscribe(channels, events.LoopQueue(Config.EVENT_QUEUE_SIZE))
+    response = Response(mimetype='text/event-stream', headers=EVENT_STREAM_HEADERS)
+    # Sent by application() after the response headers
+    response.async_body = events.async_stream(subscriber)
+    return response
+
+def in_loop(endpoint):
+    # Views answered from the in-process caches don't wait on MongoDB, so
+    # the Flask view itself runs on the loop instead of in a thread
+    view = app.view_functions[endpoint]
+
+    async def call(**values):
+        return view(**values)
+    return call
+
+ASYNC_VIEWS = {
+    'dashboard': dashboard,
+    'dashboard_page': dashboard_page,
+    'api_ratings': api_ratings,
+    'api_user_stats': api_user_stats,
+    'event_stream': event_stream,
+    'leaderboard': in_loop('leaderboard'),
+    'api_leaderboard': in_loop('api_leaderboard'),
+    'api_samples': in_loop('api_samples')
+}
+
+# ASGI plumbing
+
+def scope_environ(scope):
+    # Enough of a WSGI environ for Flask's routing, sessions and request.args
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def match(environ):
+    try:
+        endpoint, values = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None, None
+    return ASYNC_VIEWS.get(endpoint), values
+
+async def dispatch(view, environ, values):
+    # Flask's full_dispatch_request with an awaited view
+    ctx = app.request_context(environ)
+    ctx.push()
+    try:
+        try:
+            await load_session_user()
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = await view(**values)
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+        return app.finalize_request(rv)
+    except Exception as e:
+        return app.handle_exception(e)
+    finally:
+        ctx.pop()
+
+async def send_stream(body, receive, send):
+    # Stops early when the client goes away
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        async for chunk in body:
+            if watcher.done():
+                break
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body'})
+    finally:
+        watcher.cancel()
+        await body.aclose()
+
+async def lifespan(receive, send):
+    global _client
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _client is not None:
+                _client.close()
+                _client = None
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http' or scope['method'] != 'GET':
+        return await flask_app(scope, receive, send)
+
+    environ = scope_environ(scope)
+    view, values = match(environ)
+    if view is None:
+        return await flask_app(scope, receive, send)
+
+    response = await dispatch(view, environ, values)
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+    })
+    body = getattr(response, 'async_body', None)
+    if body is None:
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+    else:
+        await send_stream(body, receive, send)
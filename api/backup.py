@@ -1,29 +1,255 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+import argparse
+import gzip
 import json
-from bson import ObjectId
-from flask import current_app
-
-class JSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, ObjectId):
-            return str(o)
-        if isinstance(o, datetime):
-            return o.isoformat()
-        return json.JSONEncoder.default(self, o)
-
-def backup_database():
+import logging
+import os
+
+from bson import json_util, ObjectId
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from . import mongo
+from .config import Config
+from .tombstones import NOT_DELETED
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS = ('users', 'samples', 'ratings')
+BATCH_SIZE = 1000
+MANIFEST = 'manifest.json'
+
+# Ratings are only ever inserted, so a delta only needs the ratings created
+# since the previous backup. Users and samples are small (every worker holds
+# them in memory) but change or disappear in place, so every backup carries
+# a full copy of both, without tombstoned documents. A restore takes them
+# from the newest copy and leaves out ratings whose user or sample is gone.
+DELTA_COLLECTIONS = ('ratings',)
+
+# Canonical Extended JSON keeps ObjectIds and datetimes intact on restore
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+
+def log_progress(collection, count):
+    logger.info(f"{collection}: {count} documents")
+
+def open_ndjson(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def find_collection_file(directory, collection):
+    for name in (f'{collection}.ndjson.gz', f'{collection}.ndjson'):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+def load_manifest(root):
+    path = os.path.join(root, MANIFEST)
+    if not os.path.exists(path):
+        return {'backups': []}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(root, manifest):
+    # Write then rename so a crash never leaves a half-written manifest
+    path = os.path.join(root, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def export_collection(collection, path, batch_size=BATCH_SIZE, progress=log_progress, query=None):
+    # Streams one collection to NDJSON, holding at most one cursor batch in memory
+    count = 0
+    with open_ndjson(path, 'w') as f:
+        for doc in mongo.db[collection].find(query or {}).sort('_id', 1).batch_size(batch_size):
+            f.write(json_util.dumps(doc, json_options=JSON_OPTIONS))
+            f.write('\n')
+            count += 1
+            if count % batch_size == 0:
+                progress(collection, count)
+    progress(collection, count)
+    return count
+
+def import_collection(collection, path, batch_size=BATCH_SIZE, progress=log_progress, replace=False, keep=None):
+    # Loads NDJSON in insert_many chunks. Documents that already exist are
+    # skipped, so an interrupted restore can simply be run again. With
+    # replace they are overwritten instead. Documents keep() rejects are
+    # left out. Returns the inserted, skipped and left out counts.
+    inserted = 0
+    skipped = 0
+    dropped = 0
+
+    def flush(chunk):
+        if replace:
+            mongo.db[collection].bulk_write(
+                [ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in chunk], ordered=False
+            )
+            return len(chunk), 0
+        try:
+            return len(mongo.db[collection].insert_many(chunk, ordered=False).inserted_ids), 0
+        except BulkWriteError as e:
+            return e.details['nInserted'], len(e.details['writeErrors'])
+
+    chunk = []
+    with open_ndjson(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            doc = json_util.loads(line, json_options=JSON_OPTIONS)
+            if keep and not keep(doc):
+                dropped += 1
+                continue
+            chunk.append(doc)
+            if len(chunk) >= batch_size:
+                done, dupes = flush(chunk)
+                inserted += done
+                skipped += dupes
+                chunk = []
+                progress(collection, inserted)
+    if chunk:
+        done, dupes = flush(chunk)
+        inserted += done
+        skipped += dupes
+    progress(collection, inserted)
+    return inserted, skipped, dropped
+
+def read_ids(path):
+    with open_ndjson(path, 'r') as f:
+        return {json_util.loads(line, json_options=JSON_OPTIONS)['_id'] for line in f if line.strip()}
+
+def backup_database(root=None, incremental=False, compress=True, batch_size=BATCH_SIZE, progress=log_progress):
+    # Writes root/backup_<timestamp>/ and records it in root/manifest.json.
+    # An incremental backup only exports the ratings created after the
+    # high-water mark of the previous backup in the manifest.
     try:
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        backup = {
-            'users': list(current_app.mongo.db.users.find()),
-            'samples': list(current_app.mongo.db.samples.find()),
-            'ratings': list(current_app.mongo.db.ratings.find())
-        }
-        
-        with open(f'backup_{timestamp}.json', 'w') as f:
-            json.dump(backup, f, cls=JSONEncoder)
-            
+        root = root or Config.BACKUP_DIR
+        started = datetime.utcnow()
+        name = f"backup_{started.strftime('%Y%m%d_%H%M%S_%f')}"
+        directory = os.path.join(root, name)
+        os.makedirs(directory, exist_ok=True)
+        extension = '.ndjson.gz' if compress else '.ndjson'
+
+        manifest = load_manifest(root)
+        previous = manifest['backups'][-1] if manifest['backups'] else None
+        if incremental and previous is None:
+            logger.info("No previous backup in manifest, taking a full backup")
+            incremental = False
+
+        # A delta reaches BACKUP_OVERLAP_SECONDS back into the previous
+        # backup, by ObjectId time so it reads the _id index. Ratings stored
+        # while the backup runs may land in two backups; restores skip the
+        # ones they already have.
+        collections = {}
+        for collection in COLLECTIONS:
+            since = None
+            query = NOT_DELETED
+            if collection in DELTA_COLLECTIONS:
+                query = None
+                if incremental:
+                    since = previous['collections'][collection]['until']
+                    overlap = timedelta(seconds=Config.BACKUP_OVERLAP_SECONDS)
+                    query = {'_id': {'$gte': ObjectId.from_datetime(datetime.fromisoformat(since) - overlap)}}
+
+            path = os.path.join(directory, collection + extension)
+            count = export_collection(collection, path, batch_size, progress, query)
+            collections[collection] = {
+                'file': collection + extension,
+                'since': since,
+                'until': started.isoformat(),
+                'count': count
+            }
+
+        manifest['backups'].append({
+            'name': name,
+            'type': 'delta' if incremental else 'full',
+            'created_at': started.isoformat(),
+            'collections': collections
+        })
+        save_manifest(root, manifest)
+
+        logger.info(f"{'Incremental' if incremental else 'Full'} backup written to {directory}")
+        return directory
+    except Exception as e:
+        logger.error(f"Backup error: {str(e)}")
+        return None
+
+def restore_chain(root):
+    # The latest full backup followed by every delta taken after it
+    backups = load_manifest(root)['backups']
+    fulls = [i for i, backup in enumerate(backups) if backup['type'] == 'full']
+    if not fulls:
+        return []
+    return backups[fulls[-1]:]
+
+def replay(chain, collection):
+    # Each collection is replayed from its newest full copy: the newest
+    # backup for users and samples, the base for ratings
+    start = max(i for i, backup in enumerate(chain)
+                if backup['collections'].get(collection, {}).get('since') is None)
+    return chain[start:]
+
+def restore_database(directory, batch_size=BATCH_SIZE, progress=log_progress):
+    # Accepts either a single backup directory or a backup root with a
+    # manifest, in which case the base backup and its deltas are replayed
+    try:
+        if os.path.exists(os.path.join(directory, MANIFEST)):
+            chain = restore_chain(directory)
+            if not chain:
+                logger.error(f"No full backup recorded in {directory}")
+                return False
+            for backup in chain:
+                backup['path'] = os.path.join(directory, backup['name'])
+        else:
+            chain = [{'path': directory, 'collections': {}}]
+
+        # Ratings need the users and samples they belong to
+        kept = {}
+        for collection in COLLECTIONS:
+            keep = None
+            if collection == 'ratings':
+                keep = lambda doc: all(ids is None or doc.get(field) in ids for field, ids in (
+                    ('user_id', kept['users']), ('sample_id', kept['samples'])))
+            else:
+                kept[collection] = set()
+            for backup in replay(chain, collection):
+                path = find_collection_file(backup['path'], collection)
+                if not path:
+                    logger.warning(f"No {collection} file in {backup['path']}, skipping")
+                    # Without the copy there is nothing to check ratings against
+                    kept[collection] = None
+                    continue
+                replace = collection not in DELTA_COLLECTIONS
+                if kept.get(collection) is not None:
+                    kept[collection] |= read_ids(path)
+                inserted, skipped, dropped = import_collection(collection, path, batch_size, progress, replace, keep)
+                logger.info(f"Restored {inserted} {collection} from {backup['path']} "
+                            f"({skipped} already present, {dropped} left out)")
         return True
     except Exception as e:
-        current_app.logger.error(f"Backup error: {str(e)}")
-        return False 
\ No newline at end of file
+        logger.error(f"Restore error: {str(e)}")
+        return False
+
+def main():
+    parser = argparse.ArgumentParser(description='Back up or restore the Rating Meter database')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backup = commands.add_parser('backup')
+    backup.add_argument('--dir', help='backup root holding the manifest (default: BACKUP_DIR)')
+    backup.add_argument('--incremental', action='store_true', help='only export documents created since the last backup')
+    backup.add_argument('--no-compress', action='store_true', help='write plain NDJSON instead of gzip')
+    backup.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    restore = commands.add_parser('restore')
+    restore.add_argument('dir', help='backup root with a manifest, or a single backup directory')
+    restore.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    args = parser.parse_args()
+    if args.command == 'backup':
+        ok = backup_database(args.dir, args.incremental, not args.no_compress, args.batch_size)
+    else:
+        ok = restore_database(args.dir, args.batch_size)
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+from collections import defaultdict
+from datetime import datetime
+import logging
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from . import mongo
+from .catalog import catalog
+from .leaderboard import leaderboard, invalidate_cache
+from .models import user_cache
+from . import stats
+from . import events
+from .versions import versions
+from .tombstones import NOT_DELETED
+from .utils import validate_object_id, validate_rating, calculate_points
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+def error(index, message):
+    return {'index': index, 'status': 'error', 'message': message}
+
+def ingest_ratings(items):
+    # Validates and stores a batch of ratings. Every item gets a result, so a
+    # bad rating is reported on its own instead of failing the whole batch.
+    results = [None] * len(items)
+    candidates = []
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = error(index, 'Rating must be an object')
+            continue
+        user_id = validate_object_id(item.get('user_id'))
+        sample_id = validate_object_id(item.get('sample_id'))
+        if not user_id:
+            results[index] = error(index, 'Invalid user_id')
+        elif not sample_id:
+            results[index] = error(index, 'Invalid sample_id')
+        elif not validate_rating(item.get('rating')):
+            results[index] = error(index, 'Rating must be between 0 and 10')
+        else:
+            candidates.append((index, user_id, sample_id, float(item['rating'])))
+
+    # One query for every player referenced by the batch
+    user_ids = list({user_id for _, user_id, _, _ in candidates})
+    players = {
+        user['_id'] for user in
+        mongo.db.users.find({'_id': {'$in': user_ids}, 'is_playmaker': False, **NOT_DELETED}, {'_id': 1})
+    }
+
+    samples = catalog.get_many({sample_id for _, _, sample_id, _ in candidates})
+
+    now = datetime.utcnow()
+    docs = []
+    positions = []
+    for index, user_id, sample_id, rating_value in candidates:
+        sample = samples.get(sample_id)
+        if user_id not in players:
+            results[index] = error(index, 'Player not found')
+        elif not sample:
+            results[index] = error(index, 'Sample not found')
+        else:
+            docs.append({
+                'user_id': user_id,
+                'sample_id': sample_id,
+                'rating_value': rating_value,
+                'points_earned': calculate_points(sample['playmaker_rating'], rating_value),
+                'created_at': now
+            })
+            positions.append(index)
+
+    failed = {}
+    if docs:
+        try:
+            mongo.db.ratings.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get('writeErrors', []):
+                failed[write_error['index']] = write_error
+
+    points_by_user = defaultdict(int)
+    stored = []
+    for position, (index, doc) in enumerate(zip(positions, docs)):
+        write_error = failed.get(position)
+        if write_error is None:
+            stored.append(doc)
+            points_by_user[doc['user_id']] += doc['points_earned']
+            results[index] = {
+                'index': index,
+                'status': 'success',
+                'rating_id': str(doc['_id']),
+                'points_earned': doc['points_earned']
+            }
+        elif write_error.get('code') == DUPLICATE_KEY:
+            results[index] = error(index, 'Sample already rated by this player')
+        else:
+            results[index] = error(index, write_error.get('errmsg', 'Write failed'))
+
+    # One $inc per player, however many of their ratings were in the batch
+    if points_by_user:
+        mongo.db.users.bulk_write([
+            UpdateOne({'_id': user_id}, {'$inc': {'points': points}})
+            for user_id, points in points_by_user.items()
+        ], ordered=False)
+        usernames = {}
+        for user in mongo.db.users.find({'_id': {'$in': list(points_by_user)}}, {'username': 1, 'points': 1}):
+            leaderboard.set_points(user['_id'], user['username'], user['points'])
+            user_cache.pop(str(user['_id']))
+            usernames[user['_id']] = user['username']
+        events.ratings_ingested(stored, usernames, catalog, leaderboard)
+
+    stats.record_ratings(stored)
+    if stored:
+        versions.bump('ratings', 'users')
+        invalidate_cache()
+
+    logger.info(f"Bulk ingest stored {len(stored)} of {len(items)} ratings")
+    return results
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+
+from pymongo.errors import PyMongoError
+
+from . import mongo
+from .config import Config
+from .tombstones import NOT_DELETED
+
+logger = logging.getLogger(__name__)
+
+class SampleCatalog:
+    # Samples keyed by _id. Samples only change through add_sample and
+    # delete_sample, which invalidate the map, so dashboards and rating
+    # submissions can be served without a round trip to the samples
+    # collection. Changes made by other workers are picked up when the map
+    # expires after ttl seconds, or immediately when following a change stream.
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._samples = None
+        self._loaded_at = None
+        self._watching = False
+        self._lock = threading.RLock()
+
+    def _load(self):
+        samples = {sample['_id']: sample for sample in mongo.db.samples.find(NOT_DELETED)}
+        logger.info(f"Sample catalog loaded with {len(samples)} samples")
+        return samples
+
+    def _expired(self):
+        if self._watching:
+            return False
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._samples is None or self._expired():
+                self._samples = self._load()
+                self._loaded_at = time.monotonic()
+            return self._samples
+
+    def get(self, sample_id):
+        sample = self._ensure_loaded().get(sample_id)
+        if sample is None:
+            # The sample may have been added by another worker since we loaded
+            sample = mongo.db.samples.find_one({'_id': sample_id, **NOT_DELETED})
+            if sample:
+                with self._lock:
+                    if self._samples is not None:
+                        self._samples[sample_id] = sample
+        return sample
+
+    def get_many(self, sample_ids):
+        # get() for a batch, with one query for all the ids not in the map
+        samples = self._ensure_loaded()
+        found = {sample_id: samples[sample_id] for sample_id in sample_ids if sample_id in samples}
+        missing = [sample_id for sample_id in sample_ids if sample_id not in found]
+        if missing:
+            loaded = {sample['_id']: sample for sample in mongo.db.samples.find({'_id': {'$in': missing}, **NOT_DELETED})}
+            if loaded:
+                with self._lock:
+                    if self._samples is not None:
+                        self._samples.update(loaded)
+            found.update(loaded)
+        return found
+
+    def all(self):
+        # Newest first, the same order as the paginated dashboard lists
+        return sorted(self._ensure_loaded().values(), key=lambda sample: sample['_id'], reverse=True)
+
+    def attach(self, ratings, require_sample=False):
+        # Joins ratings to their samples in process instead of with $lookup
+        samples = self._ensure_loaded()
+        joined = []
+        for rating in ratings:
+            sample = samples.get(rating.get('sample_id'))
+            if sample is None and require_sample:
+                continue
+            rating['sample'] = {
+                'name': sample.get('name', 'Unknown Sample') if sample else 'Unknown Sample',
+                'playmaker_rating': sample.get('playmaker_rating', 0) if sample else 0
+            }
+            joined.append(rating)
+        return joined
+
+    def invalidate(self):
+        with self._lock:
+            self._samples = None
+
+    def watch(self):
+        # Follows the samples change stream in a daemon thread. Change streams
+        # need a replica set, so on a standalone server we log and keep using
+        # the TTL.
+        thread = threading.Thread(target=self._follow_changes, name='sample-catalog-watch', daemon=True)
+        thread.start()
+        return thread
+
+    def _follow_changes(self):
+        try:
+            with mongo.db.samples.watch(full_document='updateLookup') as stream:
+                with self._lock:
+                    self._watching = True
+                    self._samples = None
+                logger.info("Sample catalog following the samples change stream")
+                for change in stream:
+                    self._apply(change)
+        except PyMongoError as e:
+            logger.error(f"Sample catalog change stream stopped: {str(e)}")
+        finally:
+            with self._lock:
+                self._watching = False
+                self._samples = None
+
+    def _apply(self, change):
+        with self._lock:
+            if self._samples is None:
+                return
+            operation = change['operationType']
+            document = change.get('fullDocument')
+            if operation in ('insert', 'replace', 'update') and document:
+                if 'deleted_at' in document:
+                    # Tombstoned by delete_sample, gone for good once purged
+                    self._samples.pop(document['_id'], None)
+                else:
+                    self._samples[document['_id']] = document
+            elif operation == 'delete':
+                self._samples.pop(change['documentKey']['_id'], None)
+            else:
+                self._samples = None
+
+catalog = SampleCatalog(Config.SAMPLE_CACHE_TTL)
+
+if Config.SAMPLE_CACHE_WATCH:
+    catalog.watch()
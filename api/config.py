@@ -16,4 +16,136 @@ class Config:
     elif not MONGODB_URI.startswith('mongodb://'):
         MONGODB_URI = f'mongodb://{MONGODB_URI}'
     
-    PLAYMAKER_PASSWORD = os.environ.get('PLAYMAKER_PASSWORD', 'qwertypoiu') 
\ No newline at end of file
+    PLAYMAKER_PASSWORD = os.environ.get('PLAYMAKER_PASSWORD', 'qwertypoiu') 
+    
+    # Dashboard pagination
+    DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', 50))
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 200))
+    
+    # Seconds before the in-process leaderboard is reloaded from MongoDB
+    LEADERBOARD_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 300))
+    
+    # Largest batch accepted by the bulk rating endpoint
+    BULK_MAX_RATINGS = int(os.environ.get('BULK_MAX_RATINGS', 5000))
+    
+    # Sample catalog cache: seconds before reloading, and whether to follow
+    # the samples change stream (requires a replica set)
+    SAMPLE_CACHE_TTL = int(os.environ.get('SAMPLE_CACHE_TTL', 60))
+    SAMPLE_CACHE_WATCH = os.environ.get('SAMPLE_CACHE_WATCH', 'false').lower() == 'true'
+    
+    # Cache of user documents read by Flask-Login on every request
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    
+    # Where backup_database writes when no directory is given, and how far
+    # back before the previous backup an incremental one starts, to catch
+    # ratings stamped before it but stored after it had read past them
+    BACKUP_DIR = os.environ.get('BACKUP_DIR', '.')
+    BACKUP_OVERLAP_SECONDS = int(os.environ.get('BACKUP_OVERLAP_SECONDS', 600))
+    
+    # Startup: connect on first query instead of at import, and how long a
+    # query waits for a reachable server before failing
+    MONGO_LAZY_CONNECT = os.environ.get('MONGO_LAZY_CONNECT', 'true').lower() == 'true'
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+    
+    # Connection pool and wire settings. The client lives for the life of the
+    # worker, so MONGO_MIN_POOL_SIZE keeps connections warm between invocations.
+    MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+    MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 1))
+    MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 20000))
+    MONGO_RETRY_WRITES = os.environ.get('MONGO_RETRY_WRITES', 'true').lower() == 'true'
+    MONGO_RETRY_READS = os.environ.get('MONGO_RETRY_READS', 'true').lower() == 'true'
+    # Comma separated, e.g. "zstd,snappy,zlib". zstd and snappy need the
+    # zstandard and python-snappy packages.
+    MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')
+    MONGO_APP_NAME = os.environ.get('MONGO_APP_NAME', 'rating-meter')
+    
+    # Read preference for ordinary queries, and for the leaderboard and
+    # read-only dashboard lists that can tolerate replication lag
+    MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+    MONGO_SECONDARY_READ_PREFERENCE = os.environ.get('MONGO_SECONDARY_READ_PREFERENCE', 'secondaryPreferred')
+    
+    @classmethod
+    def mongo_client_options(cls):
+        # Keyword arguments for every MongoClient the app and its scripts create
+        options = {
+            'connect': not cls.MONGO_LAZY_CONNECT,
+            'serverSelectionTimeoutMS': cls.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            'maxPoolSize': cls.MONGO_MAX_POOL_SIZE,
+            'minPoolSize': cls.MONGO_MIN_POOL_SIZE,
+            'maxIdleTimeMS': cls.MONGO_MAX_IDLE_TIME_MS,
+            'connectTimeoutMS': cls.MONGO_CONNECT_TIMEOUT_MS,
+            'socketTimeoutMS': cls.MONGO_SOCKET_TIMEOUT_MS,
+            'retryWrites': cls.MONGO_RETRY_WRITES,
+            'retryReads': cls.MONGO_RETRY_READS,
+            'readPreference': cls.MONGO_READ_PREFERENCE,
+            'appname': cls.MONGO_APP_NAME
+        }
+        if cls.MONGO_COMPRESSORS:
+            options['compressors'] = cls.MONGO_COMPRESSORS
+        return options
+    
+    # Server-Sent Events: per-client queue length, keepalive interval, how
+    # long a stream stays open before the browser reconnects, and whether to
+    # publish from the ratings change stream (requires a replica set) so
+    # clients on every worker see every rating
+    EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', 100))
+    EVENT_HEARTBEAT_SECONDS = int(os.environ.get('EVENT_HEARTBEAT_SECONDS', 15))
+    EVENT_STREAM_SECONDS = int(os.environ.get('EVENT_STREAM_SECONDS', 55))
+    EVENTS_WATCH_CHANGES = os.environ.get('EVENTS_WATCH_CHANGES', 'false').lower() == 'true'
+    
+    # Whether leaderboard viewers subscribe to the event stream. An open
+    # stream holds a sync worker (or a serverless function) for
+    # EVENT_STREAM_SECONDS, so by default the page polls the ETagged
+    # /api/v1/leaderboard every LEADERBOARD_POLL_SECONDS instead. Async mode
+    # (api/asgi.py) serves streams on its loop and always turns this on.
+    EVENTS_STREAMING = os.environ.get('EVENTS_STREAMING', 'false').lower() == 'true'
+    LEADERBOARD_POLL_SECONDS = int(os.environ.get('LEADERBOARD_POLL_SECONDS', 15))
+    
+    # Seconds a worker trusts its copy of the collection version counters
+    # behind the JSON API ETags
+    VERSION_CACHE_TTL = float(os.environ.get('VERSION_CACHE_TTL', 2))
+    
+    # Response cache for the public leaderboard. Empty caches in each worker;
+    # a redis:// URL (needs the redis package) shares it between workers.
+    RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', '')
+    LEADERBOARD_CACHE_TTL = int(os.environ.get('LEADERBOARD_CACHE_TTL', 5))
+    
+    # Observability: log level, thresholds for the slow request and slow
+    # Mongo command logs, and an optional bearer token for /api/metrics
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    
+    # Password hashing: Werkzeug method (e.g. "pbkdf2:sha256:600000"), salt
+    # length, hashing threads, how many more hashes may wait for a thread,
+    # and seconds a request waits for a free slot before it is turned away.
+    # Stored hashes are upgraded on login when the method or salt changes.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 16))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+    
+    # Async serving mode (api/asgi.py): threads running the routes it hands
+    # to the WSGI app, so one slow response doesn't hold up the others
+    ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 32))
+    
+    # Background jobs (python -m api.jobs worker): documents per cascade
+    # batch, seconds a claimed job stays leased to its worker between
+    # heartbeats, attempts before a job is marked failed, how often an idle
+    # worker polls, and how long finished jobs are kept
+    JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', 1000))
+    JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 2))
+    JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 7 * 24 * 3600))
+    
+    # Seconds a worker trusts its list of users and samples being purged
+    TOMBSTONE_CACHE_TTL = float(os.environ.get('TOMBSTONE_CACHE_TTL', 5))
+    
+    # Ratings per batch streamed into the analytics report (needs numpy)
+    ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', 50000))
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import pytest
+
+# Factories for the documents the tests need, written straight to the test
+# database. Each returns the new ids.
+
+@pytest.fixture
+def make_user(db):
+    def make_user(username='player', points=0, is_playmaker=False):
+        return db.users.insert_one({
+            'username': username, 'password_hash': '', 'is_playmaker': is_playmaker,
+            'points': points, 'created_at': datetime.utcnow()
+        }).inserted_id
+    return make_user
+
+@pytest.fixture
+def make_samples(db):
+    def make_samples(n, name='sample'):
+        return db.samples.insert_many([
+            {'name': f'{name}{i}', 'description': '', 'playmaker_rating': 5.0, 'created_at': datetime.utcnow()}
+            for i in range(n)
+        ]).inserted_ids
+    return make_samples
+
+@pytest.fixture
+def rate(db):
+    # Exact ratings of every given sample, with the points awarded as the
+    # rating routes would
+    def rate(user_id, sample_ids):
+        db.ratings.insert_many([
+            {'user_id': user_id, 'sample_id': sample_id, 'rating_value': 5.0,
+             'points_earned': 10, 'created_at': datetime.utcnow()}
+            for sample_id in sample_ids
+        ])
+        db.users.update_one({'_id': user_id}, {'$inc': {'points': 10 * len(sample_ids)}})
+    return rate
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+
+from pymongo.errors import PyMongoError
+
+from . import mongo
+from .config import Config
+from .queries import DATE_FORMAT
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = ('leaderboard', 'ratings')
+
+class Publisher:
+    # In-process fan-out for Server-Sent Events. Every connected client gets
+    # a bounded queue, so one write is pushed to all of them instead of each
+    # client re-running the page queries. A client that falls behind loses
+    # events rather than holding memory.
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels, subscriber=None):
+        subscriber = subscriber or queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers[subscriber] = set(channels)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.pop(subscriber, None)
+
+    def publish(self, channel, data):
+        with self._lock:
+            subscribers = [s for s, channels in self._subscribers.items() if channel in channels]
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((channel, data))
+            except queue.Full:
+                logger.warning("Dropping event for a slow event stream client")
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+publisher = Publisher(Config.EVENT_QUEUE_SIZE)
+
+class LoopQueue:
+    # Subscriber queue for a stream served on an event loop. publish() runs
+    # in request and watcher threads, so items are handed to the loop.
+    def __init__(self, maxsize):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+
+    def put_nowait(self, item):
+        self.loop.call_soon_threadsafe(self._put, item)
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            logger.warning("Dropping event for a slow event stream client")
+
+    def get(self):
+        return self.queue.get()
+
+def format_event(channel, data):
+    return f"event: {channel}\ndata: {json.dumps(data)}\n\n"
+
+def stream(subscriber, heartbeat=Config.EVENT_HEARTBEAT_SECONDS, duration=Config.EVENT_STREAM_SECONDS):
+    # Ends after duration seconds so a serverless function isn't held open
+    # past its limit; EventSource reconnects on its own after retry ms.
+    try:
+        yield 'retry: 3000\n\n'
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            try:
+                channel, data = subscriber.get(timeout=heartbeat)
+                yield format_event(channel, data)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+    finally:
+        publisher.unsubscribe(subscriber)
+
+async def async_stream(subscriber, heartbeat=Config.EVENT_HEARTBEAT_SECONDS, duration=Config.EVENT_STREAM_SECONDS):
+    # stream() for a LoopQueue subscriber, waiting without holding a thread
+    try:
+        yield 'retry: 3000\n\n'
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            try:
+                channel, data = await asyncio.wait_for(subscriber.get(), heartbeat)
+                yield format_event(channel, data)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+    finally:
+        publisher.unsubscribe(subscriber)
+
+def rating_event(rating, username, sample):
+    return {
+        'user': {'username': username},
+        'sample': {
+            'name': sample.get('name', 'Unknown Sample') if sample else 'Unknown Sample',
+            'playmaker_rating': sample.get('playmaker_rating', 0) if sample else 0
+        },
+        'rating_value': rating['rating_value'],
+        'points_earned': rating['points_earned'],
+        'formatted_date': rating['created_at'].strftime(DATE_FORMAT)
+    }
+
+def leaderboard_event(board, user_id, username, points):
+    return {
+        'user': {'id': str(user_id), 'username': username, 'points': points, 'rank': board.rank(points)},
+        'top': board.top(10)
+    }
+
+def rating_submitted(rating, username, sample, points, board):
+    # Called by the routes that store ratings. When following the change
+    # stream every worker publishes from there instead, so skip it here.
+    if Config.EVENTS_WATCH_CHANGES:
+        return
+    publisher.publish('ratings', rating_event(rating, username, sample))
+    publisher.publish('leaderboard', leaderboard_event(board, rating['user_id'], username, points))
+
+def ratings_ingested(ratings, usernames, catalog, board):
+    # Bulk ingestion publishes every rating but only one leaderboard update
+    if Config.EVENTS_WATCH_CHANGES:
+        return
+    for rating in ratings:
+        username = usernames.get(rating['user_id'], 'Unknown User')
+        publisher.publish('ratings', rating_event(rating, username, catalog.get(rating['sample_id'])))
+    publisher.publish('leaderboard', {'user': None, 'top': board.top(10)})
+
+def player_removed(board):
+    # The change stream only follows inserts, so removals are always local
+    publisher.publish('leaderboard', {'user': None, 'top': board.top(10)})
+
+def watch_ratings(catalog, board):
+    # Follows inserts into ratings so clients connected to any worker see
+    # ratings stored by every worker. Needs a replica set.
+    def follow():
+        try:
+            pipeline = [{'$match': {'operationType': 'insert'}}]
+            with mongo.db.ratings.watch(pipeline) as changes:
+                logger.info("Event publisher following the ratings change stream")
+                for change in changes:
+                    rating = change['fullDocument']
+                    user = mongo.db.users.find_one({'_id': rating['user_id']}, {'username': 1, 'points': 1})
+                    if not user:
+                        continue
+                    board.set_points(user['_id'], user['username'], user['points'])
+                    sample = catalog.get(rating['sample_id'])
+                    publisher.publish('ratings', rating_event(rating, user['username'], sample))
+                    publisher.publish('leaderboard', leaderboard_event(board, user['_id'], user['username'], user['points']))
+        except PyMongoError as e:
+            logger.error(f"Ratings change stream stopped: {str(e)}")
+
+    thread = threading.Thread(target=follow, name='ratings-event-watch', daemon=True)
+    thread.start()
+    return thread
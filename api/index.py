@@ -1,38 +1,58 @@
-from flask import render_template, request, redirect, url_for, flash, session, jsonify
+from flask import render_template, request, redirect, url_for, flash, session, jsonify, Response
 from flask_login import login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import os
 import logging
 from bson import ObjectId
-from pymongo.errors import PyMongoError
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError, DuplicateKeyError
 
-from . import app, mongo, login_manager
-from .models import User
+from . import app, mongo, login_manager, secondary_collection
+from .models import User, user_cache
 from .config import Config
+from .queries import (split_page, samples_page, with_stats,
+                      ratings_page_pipeline, players_page_find, player_ratings_pipeline, unrated_samples)
+from .utils import serialize_doc, parse_page_args, calculate_points, validate_rating
+from .leaderboard import leaderboard as player_leaderboard
+from .leaderboard import cached_top, cached_page, invalidate_cache as invalidate_leaderboard_cache
+from .catalog import catalog
+from .bulk import ingest_ratings
+from .migrate import setup_mongodb_indexes
+from . import stats
+from . import events
+from . import metrics
+from .versions import versions
+from .tombstones import tombstones, NOT_DELETED
+from . import jobs
+from .passwords import hasher, HashingBusy
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Configure app
-app.config['SECRET_KEY'] = Config.SECRET_KEY
-app.config['MONGO_URI'] = Config.MONGODB_URI
-
-# Initialize extensions
-mongo.init_app(app)
-login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 PLAYMAKER_PASSWORD = Config.PLAYMAKER_PASSWORD
 
+if Config.EVENTS_WATCH_CHANGES:
+    events.watch_ratings(catalog, player_leaderboard)
+
+# Read by leaderboard.html to pick between the event stream and polling
+app.jinja_env.globals['events_streaming'] = Config.EVENTS_STREAMING
+app.jinja_env.globals['leaderboard_poll_seconds'] = Config.LEADERBOARD_POLL_SECONDS
+
 @login_manager.user_loader
 def load_user(user_id):
     try:
+        user = User.cached(user_id)
+        if user:
+            return user
         # Convert string ID to ObjectId
         if ObjectId.is_valid(user_id):
-            user_data = mongo.db.users.find_one({'_id': ObjectId(user_id)})
-            return User(user_data) if user_data else None
+            user_data = mongo.db.users.find_one({'_id': ObjectId(user_id), **NOT_DELETED})
+            if not user_data:
+                return None
+            user = User(user_data)
+            user.remember()
+            return user
         return None
     except Exception as e:
         logger.error(f"Error loading user: {str(e)}")
@@ -66,15 +86,25 @@ def register():
             flash('Invalid playmaker password')
             return redirect(url_for('register'))
         
+        try:
+            password_hash = hasher.hash(password)
+        except HashingBusy:
+            flash('The server is busy, please try again in a moment')
+            return render_template('register.html'), 503
+        
         user_data = {
             'username': username,
-            'password_hash': generate_password_hash(password),
+            'password_hash': password_hash,
             'is_playmaker': is_playmaker,
             'points': 0,
             'created_at': datetime.utcnow()
         }
         
-        mongo.db.users.insert_one(user_data)
+        result = mongo.db.users.insert_one(user_data)
+        if not is_playmaker:
+            player_leaderboard.set_points(result.inserted_id, username, 0)
+        versions.bump('users')
+        invalidate_leaderboard_cache()
         flash('Registration successful')
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -86,25 +116,31 @@ def login():
             username = request.form.get('username')
             password = request.form.get('password')
             
-            logger.debug(f"Login attempt for user: {username}")
+            logger.debug("Login attempt for user: %s", username)
             
-            user_data = mongo.db.users.find_one({'username': username})
+            user_data = mongo.db.users.find_one({'username': username, **NOT_DELETED})
             if user_data:
-                if check_password_hash(user_data['password_hash'], password):
+                if hasher.verify(user_data.get('password_hash'), password):
+                    if hasher.needs_rehash(user_data['password_hash']):
+                        hasher.upgrade(user_data['_id'], user_data['password_hash'], password)
                     try:
                         user = User(user_data)
                         login_user(user)
-                        logger.debug(f"User {username} logged in successfully")
+                        user.remember()
+                        logger.debug("User %s logged in successfully", username)
                         return redirect(url_for('dashboard'))
                     except Exception as e:
                         logger.error(f"Error creating user object: {str(e)}")
                         flash('Error during login. Please try again.')
                 else:
-                    logger.debug(f"Invalid password for user: {username}")
+                    logger.debug("Invalid password for user: %s", username)
                     flash('Invalid username or password')
             else:
-                logger.debug(f"User not found: {username}")
+                logger.debug("User not found: %s", username)
                 flash('Invalid username or password')
+        except HashingBusy:
+            flash('The server is busy, please try again in a moment')
+            return render_template('login.html'), 503
         except Exception as e:
             logger.error(f"Login error: {str(e)}")
             flash('Error during login. Please try again.')
@@ -115,81 +151,40 @@ def login():
 @login_required
 def dashboard():
     try:
-        logger.debug(f"User accessing dashboard: {current_user.username}")
+        logger.debug("User accessing dashboard: %s", current_user.username)
         
         if current_user.is_playmaker:
-            # Get all samples
-            samples = list(mongo.db.samples.find())
-            
-            # Get ratings with user information
-            ratings = []
-            ratings_cursor = mongo.db.ratings.find()
-            for rating in ratings_cursor:
-                try:
-                    # Get user information for each rating
-                    user = mongo.db.users.find_one({'_id': rating['user_id']})
-                    if user:
-                        rating['user'] = {
-                            'username': user.get('username', 'Unknown User'),
-                            'points': user.get('points', 0)
-                        }
-                    # Get sample information
-                    sample = mongo.db.samples.find_one({'_id': rating['sample_id']})
-                    if sample:
-                        rating['sample'] = {
-                            'name': sample.get('name', 'Unknown Sample'),
-                            'playmaker_rating': sample.get('playmaker_rating', 0)
-                        }
-                    rating['formatted_date'] = rating['created_at'].strftime('%Y-%m-%d %H:%M')
-                    ratings.append(rating)
-                except Exception as e:
-                    logger.error(f"Error processing rating: {str(e)}")
-                    continue
-            
-            # Get non-playmaker users
-            users = list(mongo.db.users.find({'is_playmaker': False}))
+            # Only the first page of each list is rendered, the template pages
+            # through the rest with /api/dashboard/<kind>
+            page_size = Config.DASHBOARD_PAGE_SIZE
+            samples, samples_next = get_samples_page(None, page_size)
+            ratings, ratings_next = get_ratings_page(None, page_size)
+            users, users_next = get_players_page(None, page_size)
             
             return render_template('playmaker_dashboard.html', 
                                 samples=samples, 
                                 ratings=ratings, 
                                 users=users,
+                                samples_next=samples_next,
+                                ratings_next=ratings_next,
+                                users_next=users_next,
                                 user=current_user)
         else:
-            # Get all samples
-            samples = list(mongo.db.samples.find())
-            logger.debug(f"Found {len(samples)} total samples")
-            
             try:
                 # Get user's ratings
                 user_id = ObjectId(current_user.get_id())
-                logger.debug(f"Looking for ratings for user_id: {user_id}")
-                
-                user_ratings = list(mongo.db.ratings.find({'user_id': user_id}))
-                logger.debug(f"Found {len(user_ratings)} ratings for user")
+                logger.debug("Looking for ratings for user_id: %s", user_id)
                 
-                ratings = []
-                for rating in user_ratings:
-                    try:
-                        sample = mongo.db.samples.find_one({'_id': rating['sample_id']})
-                        if sample:
-                            rating['sample'] = {
-                                'name': sample.get('name', 'Unknown Sample'),
-                                'playmaker_rating': sample.get('playmaker_rating', 0)
-                            }
-                            rating['formatted_date'] = rating['created_at'].strftime('%Y-%m-%d %H:%M')
-                            ratings.append(rating)
-                    except Exception as e:
-                        logger.error(f"Error processing individual rating: {str(e)}")
-                        continue
+                ratings = catalog.attach(mongo.db.ratings.aggregate(player_ratings_pipeline(user_id)), require_sample=True)
+                logger.debug("Found %d ratings for user", len(ratings))
                 
-                # Get unrated samples
-                rated_sample_ids = [rating.get('sample_id') for rating in ratings if rating.get('sample_id')]
-                unrated_samples = [s for s in samples if s['_id'] not in rated_sample_ids]
+                # Samples come from the catalog, so only the ratings hit the database
+                samples = unrated_samples(catalog.all(), ratings)
                 
-                logger.debug(f"Rendering dashboard with {len(unrated_samples)} unrated samples and {len(ratings)} ratings")
+                logger.debug("Rendering dashboard with %d unrated samples and %d ratings", len(samples), len(ratings))
                 
                 return render_template('player_dashboard.html', 
-                                    samples=unrated_samples, 
+                                    samples=samples, 
                                     ratings=ratings,
                                     user=current_user)
                 
@@ -203,6 +198,39 @@ def dashboard():
         flash('Error loading dashboard. Please try again.')
         return redirect(url_for('index'))
 
+def get_samples_page(before, limit):
+    docs, next_cursor = samples_page(catalog.all(), before, limit)
+    return with_stats(docs, stats.stats_for([s['_id'] for s in docs])), next_cursor
+
+def get_ratings_page(before, limit):
+    docs = catalog.attach(secondary_collection('ratings').aggregate(ratings_page_pipeline(before, limit)))
+    return split_page(docs, limit)
+
+def get_players_page(before, limit):
+    return split_page(list(secondary_collection('users').find(**players_page_find(before, limit))), limit)
+
+DASHBOARD_PAGES = {
+    'samples': get_samples_page,
+    'ratings': get_ratings_page,
+    'users': get_players_page
+}
+
+@app.route('/api/dashboard/<kind>')
+@login_required
+def dashboard_page(kind):
+    if not current_user.is_playmaker:
+        return jsonify({'status': 'error', 'message': 'Only playmakers can view this data'}), 403
+    if kind not in DASHBOARD_PAGES:
+        return jsonify({'status': 'error', 'message': f'Unknown list: {kind}'}), 404
+    
+    before, limit = parse_page_args(request.args, Config.DASHBOARD_PAGE_SIZE, Config.MAX_PAGE_SIZE)
+    items, next_cursor = DASHBOARD_PAGES[kind](before, limit)
+    return jsonify({
+        'status': 'success',
+        'items': serialize_doc(items),
+        'next': next_cursor
+    })
+
 @app.route('/add_sample', methods=['GET', 'POST'])
 @login_required
 def add_sample():
@@ -222,6 +250,8 @@ def add_sample():
         }
         
         mongo.db.samples.insert_one(sample_data)
+        catalog.invalidate()
+        versions.bump('samples')
         flash('Sample added successfully')
         return redirect(url_for('dashboard'))
     return render_template('add_sample.html')
@@ -235,31 +265,49 @@ def rate_sample(sample_id):
     try:
         # Convert string ID to ObjectId
         sample_obj_id = ObjectId(sample_id)
-        sample = mongo.db.samples.find_one({'_id': sample_obj_id})
+        sample = catalog.get(sample_obj_id)
         if not sample:
             flash('Sample not found')
             return redirect(url_for('dashboard'))
         
+        if not validate_rating(request.form.get('rating')):
+            flash('Rating must be between 0 and 10')
+            return redirect(url_for('dashboard'))
         rating_value = float(request.form.get('rating'))
         
-        # Calculate points (maximum 10 points for exact match)
-        difference = abs(sample['playmaker_rating'] - rating_value)
-        points = max(0, 10 - int(difference * 2))
+        points = calculate_points(sample['playmaker_rating'], rating_value)
+        user_id = ObjectId(current_user.id)
         
         rating_data = {
-            'user_id': ObjectId(current_user.id),
+            'user_id': user_id,
             'sample_id': sample_obj_id,
             'rating_value': rating_value,
             'points_earned': points,
             'created_at': datetime.utcnow()
         }
         
-        mongo.db.ratings.insert_one(rating_data)
-        current_user.points += points
-        mongo.db.users.update_one(
-            {'_id': ObjectId(current_user.id)}, 
-            {'$set': {'points': current_user.points}}
+        # The unique (user_id, sample_id) index rejects a second rating
+        try:
+            mongo.db.ratings.insert_one(rating_data)
+        except DuplicateKeyError:
+            flash('You have already rated this sample')
+            return redirect(url_for('dashboard'))
+        
+        # Increment atomically so concurrent submissions can't lose points
+        updated = mongo.db.users.find_one_and_update(
+            {'_id': user_id},
+            {'$inc': {'points': points}},
+            projection={'points': 1},
+            return_document=ReturnDocument.AFTER
         )
+        if updated:
+            current_user.points = updated['points']
+            current_user.remember()
+        player_leaderboard.set_points(current_user.id, current_user.username, current_user.points)
+        stats.record_rating(sample_obj_id, rating_value, points)
+        versions.bump('ratings', 'users')
+        invalidate_leaderboard_cache()
+        events.rating_submitted(rating_data, current_user.username, sample, current_user.points, player_leaderboard)
         
         flash(f'Rating submitted! You earned {points} points!')
         return redirect(url_for('dashboard'))
@@ -268,6 +316,28 @@ def rate_sample(sample_id):
         flash('Error processing rating')
         return redirect(url_for('dashboard'))
 
+@app.route('/api/ratings/bulk', methods=['POST'])
+@login_required
+def bulk_rate():
+    if not current_user.is_playmaker:
+        return jsonify({'status': 'error', 'message': 'Only playmakers can submit rating batches'}), 403
+    
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('ratings')
+    if not isinstance(items, list):
+        return jsonify({'status': 'error', 'message': 'Expected a JSON object with a ratings list'}), 400
+    if len(items) > Config.BULK_MAX_RATINGS:
+        return jsonify({'status': 'error', 'message': f'At most {Config.BULK_MAX_RATINGS} ratings per batch'}), 413
+    
+    results = ingest_ratings(items)
+    stored = sum(1 for result in results if result['status'] == 'success')
+    return jsonify({
+        'status': 'success',
+        'stored': stored,
+        'failed': len(results) - stored,
+        'results': results
+    })
+
 @app.route('/logout')
 @login_required
 def logout():
@@ -281,7 +351,7 @@ def confirm_delete_user(username):
         flash('Only playmakers can delete users')
         return redirect(url_for('dashboard'))
         
-    user = mongo.db.users.find_one({'username': username})
+    user = mongo.db.users.find_one({'username': username, **NOT_DELETED})
     if not user:
         flash('User not found')
         return redirect(url_for('dashboard'))
@@ -295,10 +365,21 @@ def delete_user(username):
         flash('Only playmakers can delete users')
         return redirect(url_for('dashboard'))
         
-    user = mongo.db.users.find_one({'username': username})
+    # Tombstone the user so every read drops them now; their ratings leave
+    # the sample stats here and are removed in batches by the purge_user job
+    user = mongo.db.users.find_one_and_update(
+        {'username': username, **NOT_DELETED},
+        {'$set': {'deleted_at': datetime.utcnow()}}
+    )
     if user:
-        mongo.db.ratings.delete_many({'user_id': user['_id']})
-        mongo.db.users.delete_one({'username': username})
+        stats.remove_user(user['_id'])
+        jobs.enqueue('purge_user', user_id=user['_id'])
+        tombstones.invalidate()
+        user_cache.pop(str(user['_id']))
+        player_leaderboard.remove(user['_id'])
+        versions.bump('users', 'ratings')
+        invalidate_leaderboard_cache()
+        events.player_removed(player_leaderboard)
         flash(f'User {username} has been deleted')
     else:
         flash(f'User {username} not found')
@@ -306,18 +387,60 @@ def delete_user(username):
 
 @app.route('/leaderboard')
 def leaderboard():
+    # Anonymous visitors all see the same page, so serve it from the cache
+    # and let browsers and the CDN keep it for the same short TTL. Pages
+    # carrying flashed messages are personal and never cached.
+    if not current_user.is_authenticated and not session.get('_flashes'):
+        page = cached_page(lambda: render_template('leaderboard.html', top_players=cached_top(10), current_user_rank=None))
+        response = app.make_response(page)
+        response.headers['Cache-Control'] = f'public, max-age={Config.LEADERBOARD_CACHE_TTL}'
+        response.vary.add('Cookie')
+        return response
+    
     # Get top 10 players by points
-    top_players = mongo.db.users.find({'is_playmaker': False}).sort('points', -1).limit(10)
+    top_players = cached_top(10)
     
     # Get current user's rank if logged in
     current_user_rank = None
     if current_user.is_authenticated and not current_user.is_playmaker:
-        higher_points = mongo.db.users.count_documents({'points': {'$gt': current_user.points}, 'is_playmaker': False})
-        current_user_rank = higher_points + 1
+        current_user_rank = player_leaderboard.rank(current_user.points)
     
-    return render_template('leaderboard.html', 
+    response = app.make_response(render_template('leaderboard.html', 
                          top_players=top_players, 
-                         current_user_rank=current_user_rank)
+                         current_user_rank=current_user_rank))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def event_channels():
+    # Server-Sent Events: leaderboard updates for anyone, the live rating
+    # feed for playmakers only. Returns the channels or an error response.
+    channels = set(request.args.get('channels', 'leaderboard').split(',')) & set(events.CHANNELS)
+    if not channels:
+        return None, (jsonify({'status': 'error', 'message': 'Unknown channels'}), 400)
+    if 'ratings' in channels and not (current_user.is_authenticated and current_user.is_playmaker):
+        return None, (jsonify({'status': 'error', 'message': 'Only playmakers can follow ratings'}), 403)
+    return channels, None
+
+EVENT_STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+@app.route('/api/events')
+def event_stream():
+    channels, error = event_channels()
+    if error:
+        return error
+    
+    subscriber = events.publisher.subscribe(channels)
+    return Response(events.stream(subscriber), mimetype='text/event-stream', headers=EVENT_STREAM_HEADERS)
+
+@app.route('/api/metrics')
+def metrics_endpoint():
+    # Prometheus text format. Set METRICS_TOKEN to require a bearer token.
+    if Config.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {Config.METRICS_TOKEN}':
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # Test API endpoint
 @app.route('/api/test')
@@ -328,6 +451,20 @@ def test_api():
         'timestamp': datetime.utcnow().isoformat()
     })
 
+@app.route('/api/cache-stats')
+def cache_stats():
+    # Cache internals, for playmakers or for a monitor holding METRICS_TOKEN
+    if not (Config.METRICS_TOKEN and request.headers.get('Authorization') == f'Bearer {Config.METRICS_TOKEN}'):
+        if not current_user.is_authenticated:
+            return jsonify({'status': 'error', 'message': 'Login required'}), 401
+        if not current_user.is_playmaker:
+            return jsonify({'status': 'error', 'message': 'Only playmakers can view this data'}), 403
+    return jsonify({
+        'status': 'success',
+        'users': user_cache.stats(),
+        'timestamp': datetime.utcnow().isoformat()
+    })
+
 @app.route('/api/db-test')
 def test_db():
     try:
@@ -364,18 +501,15 @@ def check_db_connection():
         logger.error(f"MongoDB connection error: {str(e)}")
         return False
 
-def setup_mongodb_indexes():
-    try:
-        # Create indexes for faster queries
-        mongo.db.users.create_index('username', unique=True)
-        mongo.db.ratings.create_index([('user_id', 1), ('sample_id', 1)])
-        mongo.db.users.create_index([('points', -1)])
-        logger.info("MongoDB indexes created successfully")
-    except Exception as e:
-        logger.error(f"Error creating MongoDB indexes: {str(e)}")
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    # Same as python -m api.stats
+    stats.rebuild()
 
-# Call this when the app starts
-setup_mongodb_indexes()
+@app.cli.command('create-indexes')
+def create_indexes_command():
+    # Same as python -m api.migrate, for deployments that use the flask CLI
+    setup_mongodb_indexes()
 
 @app.route('/delete_sample/<sample_id>')
 @login_required
@@ -388,13 +522,18 @@ def delete_sample(sample_id):
         # Convert string ID to ObjectId
         sample_obj_id = ObjectId(sample_id)
         
-        # First delete all ratings associated with this sample
-        mongo.db.ratings.delete_many({'sample_id': sample_obj_id})
-        
-        # Then delete the sample
-        result = mongo.db.samples.delete_one({'_id': sample_obj_id})
-        
-        if result.deleted_count > 0:
+        # Tombstone the sample so it disappears from every read now; its
+        # ratings are removed in batches by the purge_sample job
+        sample = mongo.db.samples.find_one_and_update(
+            {'_id': sample_obj_id, **NOT_DELETED},
+            {'$set': {'deleted_at': datetime.utcnow()}}
+        )
+        if sample:
+            jobs.enqueue('purge_sample', sample_id=sample_obj_id)
+            tombstones.invalidate()
+            catalog.invalidate()
+            stats.remove_sample(sample_obj_id)
+            versions.bump('samples', 'ratings')
             flash('Sample deleted successfully')
         else:
             flash('Sample not found')
@@ -0,0 +1,286 @@
+# Every index the app relies on and the shape of every query it runs, in
+# one place. setup_mongodb_indexes() creates the indexes from INDEXES; the
+# audit seeds a scratch database, runs explain() on each query in QUERIES
+# and fails on a collection scan or an in-memory sort:
+#
+#   python -m api.indexes
+#
+# When a route gets a new query, or an existing one changes its filter or
+# sort, update its entry here so the audit keeps covering it. The audit
+# also runs in the test suite (api/test_indexes.py).
+from datetime import datetime, timedelta
+import argparse
+import logging
+import os
+import random
+
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from .config import Config
+from .queries import rating_details_pipeline, page_query, players_page_find, player_ratings_pipeline
+from .stats import group_stage, stats_query
+from .tombstones import NOT_DELETED, DELETED
+
+logger = logging.getLogger(__name__)
+
+AUDIT_URI = os.environ.get('AUDIT_MONGODB_URI', 'mongodb://localhost:27017/rating_meter_audit')
+
+INDEXES = {
+    'users': [
+        ([('username', 1)], {'unique': True}),
+        # Leaderboard load, and the playmaker's players list newest first
+        ([('is_playmaker', 1), ('points', -1)], {}),
+        ([('is_playmaker', 1), ('_id', -1)], {}),
+        # Tombstones: only deleted documents have deleted_at
+        ([('deleted_at', 1)], {'sparse': True})
+    ],
+    'samples': [
+        ([('deleted_at', 1)], {'sparse': True})
+    ],
+    'ratings': [
+        ([('user_id', 1), ('sample_id', 1)], {'unique': True}),
+        # A player's ratings newest first, and purging a sample's ratings
+        ([('user_id', 1), ('_id', -1)], {}),
+        ([('sample_id', 1)], {})
+    ],
+    'jobs': [
+        # Claiming the oldest runnable job, and finding a pending purge
+        ([('status', 1), ('created_at', 1)], {}),
+        ([('type', 1), ('status', 1)], {}),
+        ([('finished_at', 1)], {'expireAfterSeconds': Config.JOB_RETENTION_SECONDS})
+    ]
+}
+
+# Stand-in values; the planner only cares about the shape
+SOME_ID = ObjectId('000000000000000000000001')
+SOME_TIME = datetime(2024, 1, 1)
+
+class QueryShape:
+    # One query as a route or job issues it. operation is find, aggregate,
+    # delete or update. full_scan marks queries that read the whole
+    # collection on purpose, such as loading the catalog or rebuilding the
+    # stats; they are explained and reported but never fail the audit.
+    def __init__(self, name, collection, operation='find', filter=None, sort=None, limit=None,
+                 pipeline=None, full_scan=False):
+        self.name = name
+        self.collection = collection
+        self.operation = operation
+        self.filter = filter or {}
+        self.sort = sort
+        self.limit = limit
+        self.pipeline = pipeline
+        self.full_scan = full_scan
+
+    def explain_command(self):
+        if self.operation == 'aggregate':
+            command = {'aggregate': self.collection, 'pipeline': self.pipeline, 'cursor': {}}
+        elif self.operation == 'delete':
+            command = {'delete': self.collection, 'deletes': [{'q': self.filter, 'limit': 0}]}
+        elif self.operation == 'update':
+            command = {'findAndModify': self.collection, 'query': self.filter, 'update': {'$set': {'audited': True}}}
+            if self.sort:
+                command['sort'] = self.sort
+        else:
+            command = {'find': self.collection, 'filter': self.filter}
+            if self.sort:
+                command['sort'] = self.sort
+            if self.limit:
+                command['limit'] = self.limit
+        return command
+
+PAGE = Config.DASHBOARD_PAGE_SIZE + 1
+PLAYERS_PAGE = players_page_find(SOME_ID, Config.DASHBOARD_PAGE_SIZE)
+
+QUERIES = [
+    # Users
+    QueryShape('login', 'users', filter={'username': 'player1', **NOT_DELETED}),
+    QueryShape('register_username_check', 'users', filter={'username': 'player1'}),
+    QueryShape('load_user', 'users', filter={'_id': SOME_ID, **NOT_DELETED}),
+    QueryShape('leaderboard_load', 'users', filter={'is_playmaker': False, **NOT_DELETED}),
+    QueryShape('players_page', 'users', filter=PLAYERS_PAGE['filter'],
+               sort=dict(PLAYERS_PAGE['sort']), limit=PLAYERS_PAGE['limit']),
+    QueryShape('delete_user', 'users', 'update', filter={'username': 'player1', **NOT_DELETED}),
+    QueryShape('award_points', 'users', 'update', filter={'_id': SOME_ID}),
+    QueryShape('bulk_players', 'users', filter={'_id': {'$in': [SOME_ID]}, 'is_playmaker': False, **NOT_DELETED}),
+    QueryShape('tombstoned_users', 'users', filter=DELETED),
+    QueryShape('backup_users', 'users', filter=NOT_DELETED, sort={'_id': 1}),
+
+    # Samples
+    QueryShape('catalog_load', 'samples', filter=NOT_DELETED, full_scan=True),
+    QueryShape('catalog_miss', 'samples', filter={'_id': SOME_ID, **NOT_DELETED}),
+    QueryShape('delete_sample', 'samples', 'update', filter={'_id': SOME_ID, **NOT_DELETED}),
+    QueryShape('tombstoned_samples', 'samples', filter=DELETED),
+
+    # Ratings
+    QueryShape('player_dashboard', 'ratings', 'aggregate', pipeline=player_ratings_pipeline(SOME_ID)),
+    QueryShape('own_ratings_page', 'ratings', 'aggregate', pipeline=rating_details_pipeline(
+        page_query(SOME_ID, {'user_id': SOME_ID, 'sample_id': {'$nin': [SOME_ID]}}), PAGE,
+        with_user=False, with_sample=False)),
+    QueryShape('ratings_first_page', 'ratings', 'aggregate', pipeline=rating_details_pipeline(
+        {}, PAGE, with_sample=False)),
+    QueryShape('ratings_page', 'ratings', 'aggregate', pipeline=rating_details_pipeline(
+        page_query(SOME_ID, {'user_id': {'$nin': [SOME_ID]}, 'sample_id': {'$nin': [SOME_ID]}}), PAGE,
+        with_sample=False)),
+    QueryShape('user_stats_totals', 'ratings', 'aggregate', pipeline=[
+        {'$match': {'user_id': SOME_ID}},
+        {'$group': {'_id': None, 'count': {'$sum': 1}}}
+    ]),
+    QueryShape('purge_user_batch', 'ratings', filter={'user_id': SOME_ID}, limit=Config.JOB_BATCH_SIZE),
+    QueryShape('purge_sample_batch', 'ratings', filter={'sample_id': SOME_ID}, limit=Config.JOB_BATCH_SIZE),
+    QueryShape('purge_delete_batch', 'ratings', 'delete', filter={'_id': {'$in': [SOME_ID]}}),
+    QueryShape('stats_remove_user', 'ratings', 'aggregate', pipeline=[{'$match': {'user_id': SOME_ID}}, group_stage()]),
+    QueryShape('stats_rebuild', 'ratings', 'aggregate', pipeline=[
+        {'$match': {'user_id': {'$nin': [SOME_ID]}, 'sample_id': {'$nin': [SOME_ID]}}}, group_stage()], full_scan=True),
+    QueryShape('analytics_load', 'ratings', filter={'user_id': {'$nin': [SOME_ID]}}, full_scan=True),
+    QueryShape('backup_full', 'ratings', sort={'_id': 1}),
+    QueryShape('backup_delta', 'ratings', filter={'_id': {'$gte': SOME_ID}}, sort={'_id': 1}),
+
+    # Sample stats, versions and jobs
+    QueryShape('stats_for', 'sample_stats', filter=stats_query([SOME_ID])),
+    QueryShape('versions', 'meta', filter={'_id': 'versions'}),
+    QueryShape('claim_job', 'jobs', 'update', filter={'$or': [
+        {'status': 'queued', 'run_after': {'$lte': SOME_TIME}},
+        {'status': 'running', 'locked_until': {'$lt': SOME_TIME}}
+    ]}, sort={'created_at': 1}),
+    QueryShape('pending_purge', 'jobs', filter={
+        'type': 'purge_user', 'params.user_id': SOME_ID, 'status': {'$in': ['queued', 'running']}
+    }),
+    QueryShape('job_heartbeat', 'jobs', 'update', filter={'_id': SOME_ID, 'worker': 'audit', 'status': 'running'})
+]
+
+def create_indexes(db):
+    # Each index on its own, so one that can't be built doesn't stop the
+    # rest. Returns (collection, keys, error) for every one that failed.
+    failed = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection].create_index(keys, **options)
+            except PyMongoError as e:
+                failed.append((collection, keys, str(e)))
+    return failed
+
+def undeclared_indexes(db):
+    # Indexes in the database that INDEXES doesn't know about, e.g. left
+    # behind by an older release
+    declared = {
+        (collection, tuple((field, direction) for field, direction in keys))
+        for collection, indexes in INDEXES.items() for keys, _ in indexes
+    }
+    extra = []
+    for collection in INDEXES:
+        for name, info in db[collection].index_information().items():
+            key = tuple((field, int(direction)) for field, direction in info['key'])
+            if name != '_id_' and (collection, key) not in declared:
+                extra.append((collection, name))
+    return extra
+
+def seed(db, players=200, samples=50, ratings_per_player=5):
+    # A small data set, so no query is answered by an empty collection's EOF
+    # plan. Replaces whatever is in the audited collections.
+    for collection in ('users', 'samples', 'ratings', 'sample_stats', 'meta', 'jobs'):
+        db[collection].delete_many({})
+    failed = create_indexes(db)
+    if failed:
+        raise RuntimeError(f"Could not create the declared indexes: {failed}")
+    now = datetime.utcnow()
+    sample_ids = db.samples.insert_many([
+        {'name': f'sample{i}', 'description': '', 'playmaker_rating': 5.0, 'created_at': now}
+        for i in range(samples)
+    ]).inserted_ids
+    user_ids = db.users.insert_many([
+        {'username': f'player{i}', 'password_hash': '', 'is_playmaker': i == 0,
+         'points': random.randint(0, 100), 'created_at': now}
+        for i in range(players)
+    ]).inserted_ids
+    db.ratings.insert_many([
+        {'user_id': user_id, 'sample_id': sample_id, 'rating_value': 5.0, 'points_earned': 10, 'created_at': now}
+        for user_id in user_ids for sample_id in random.sample(sample_ids, ratings_per_player)
+    ])
+    db.sample_stats.insert_many([{'_id': sample_id, 'count': 1} for sample_id in sample_ids])
+    db.meta.insert_one({'_id': 'versions', 'users': 1})
+    db.jobs.insert_many([
+        {'type': 'rebuild_stats', 'params': {}, 'status': status, 'attempts': 1,
+         'created_at': now - timedelta(minutes=i), 'run_after': now}
+        for i, status in enumerate(['done', 'queued', 'running', 'failed'] * 5)
+    ])
+
+def winning_stages(explain):
+    # Stage names of every winning plan in an explain result, for both the
+    # classic and slot-based engine layouts and aggregation $cursor stages.
+    # A $sort left in the aggregation stages wasn't pushed down to an index,
+    # so it counts as an in-memory SORT.
+    stages = []
+
+    def collect(plan):
+        if isinstance(plan, dict):
+            if isinstance(plan.get('stage'), str):
+                stages.append(plan['stage'])
+            for value in plan.values():
+                collect(value)
+        elif isinstance(plan, list):
+            for value in plan:
+                collect(value)
+
+    def walk(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in ('winningPlan', 'queryPlan'):
+                    collect(value)
+                elif key == 'stages' and isinstance(value, list):
+                    for stage in value:
+                        if isinstance(stage, dict) and '$sort' in stage:
+                            stages.append('SORT')
+                        walk(stage)
+                elif key not in ('rejectedPlans', 'command', 'parsedQuery'):
+                    walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(explain)
+    return stages
+
+def plan_problems(stages):
+    problems = []
+    if 'COLLSCAN' in stages:
+        problems.append('COLLSCAN')
+    if 'SORT' in stages:
+        problems.append('in-memory SORT')
+    return problems
+
+def audit(db, queries=QUERIES):
+    results = []
+    for query in queries:
+        explain = db.command('explain', query.explain_command(), verbosity='queryPlanner')
+        stages = winning_stages(explain)
+        problems = plan_problems(stages)
+        results.append({
+            'name': query.name,
+            'collection': query.collection,
+            'stages': stages,
+            'problems': problems,
+            'failed': bool(problems) and not query.full_scan
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit the query plans of every registered query')
+    parser.add_argument('--uri', default=AUDIT_URI, help='scratch database to seed and audit (default: AUDIT_MONGODB_URI)')
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri, **Config.mongo_client_options()).get_database()
+    seed(db)
+    results = audit(db)
+    for result in results:
+        status = 'FAIL' if result['failed'] else ('scan' if result['problems'] else 'ok')
+        print(f"{status:<6}{result['collection'] + '.' + result['name']:<36}{' > '.join(result['stages'])}")
+    failed = [result['name'] for result in results if result['failed']]
+    if failed:
+        print(f"{len(failed)} of {len(results)} queries need an index: {', '.join(failed)}")
+    raise SystemExit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+# Background jobs kept in the jobs collection, for work too slow for a
+# request: purging deleted users and samples, stats rebuilds and backups.
+# Run one or more workers next to the app; they share the queue:
+#
+#   python -m api.jobs worker
+#   python -m api.jobs enqueue rebuild_stats
+#   python -m api.jobs enqueue backup --incremental
+#   python -m api.jobs status
+#
+# A worker leases the job it claims and renews the lease as it makes
+# progress. If it dies, the job is picked up again once the lease expires,
+# so every handler must be safe to run more than once.
+from datetime import datetime, timedelta
+import argparse
+import logging
+import os
+import socket
+import time
+
+from pymongo import ReturnDocument
+
+from . import mongo
+from . import stats
+from . import backup
+from .config import Config
+from .tombstones import DELETED
+from .versions import versions
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+class LeaseLost(Exception):
+    pass
+
+def lease_until():
+    return datetime.utcnow() + timedelta(seconds=Config.JOB_LEASE_SECONDS)
+
+def enqueue(job_type, **params):
+    if job_type not in HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    now = datetime.utcnow()
+    return mongo.db.jobs.insert_one({
+        'type': job_type,
+        'params': params,
+        'status': QUEUED,
+        'attempts': 0,
+        'created_at': now,
+        'run_after': now
+    }).inserted_id
+
+def claim(worker):
+    # The oldest runnable job, or a running one whose worker stopped renewing
+    now = datetime.utcnow()
+    return mongo.db.jobs.find_one_and_update(
+        {'$or': [
+            {'status': QUEUED, 'run_after': {'$lte': now}},
+            {'status': RUNNING, 'locked_until': {'$lt': now}}
+        ]},
+        {
+            '$set': {'status': RUNNING, 'worker': worker, 'started_at': now, 'locked_until': lease_until()},
+            '$inc': {'attempts': 1}
+        },
+        sort=[('created_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def owned(job):
+    return {'_id': job['_id'], 'worker': job['worker'], 'status': RUNNING}
+
+def heartbeat(job, **progress):
+    # Renews the lease and records progress. Raises LeaseLost if another
+    # worker has taken the job over, so the handler stops.
+    update = {'locked_until': lease_until()}
+    update.update({f'progress.{key}': value for key, value in progress.items()})
+    if mongo.db.jobs.update_one(owned(job), {'$set': update}).matched_count == 0:
+        raise LeaseLost()
+
+def finish(job):
+    mongo.db.jobs.update_one(owned(job), {
+        '$set': {'status': DONE, 'finished_at': datetime.utcnow()},
+        '$unset': {'locked_until': '', 'error': ''}
+    })
+
+def fail(job, message):
+    # Retried with exponential backoff until JOB_MAX_ATTEMPTS
+    now = datetime.utcnow()
+    if job['attempts'] >= Config.JOB_MAX_ATTEMPTS:
+        update = {'status': FAILED, 'finished_at': now, 'error': message}
+    else:
+        delay = min(3600, 10 * 2 ** job['attempts'])
+        update = {'status': QUEUED, 'run_after': now + timedelta(seconds=delay), 'error': message}
+    mongo.db.jobs.update_one(owned(job), {'$set': update, '$unset': {'locked_until': ''}})
+
+# Handlers
+
+def purge_user(job):
+    # Deletes a tombstoned user's ratings a batch at a time, then the user.
+    # The ratings already left the sample stats when the user was
+    # tombstoned, so the batches only need deleting.
+    user_id = job['params']['user_id']
+    deleted = job.get('progress', {}).get('ratings', 0)
+    while True:
+        ids = [rating['_id'] for rating in
+               mongo.db.ratings.find({'user_id': user_id}, {'_id': 1}).limit(Config.JOB_BATCH_SIZE)]
+        if not ids:
+            break
+        deleted += mongo.db.ratings.delete_many({'_id': {'$in': ids}}).deleted_count
+        heartbeat(job, ratings=deleted)
+    mongo.db.users.delete_one({'_id': user_id, **DELETED})
+    versions.bump('users', 'ratings')
+    logger.info(f"Purged user {user_id} and {deleted} ratings")
+
+def purge_sample(job):
+    sample_id = job['params']['sample_id']
+    deleted = job.get('progress', {}).get('ratings', 0)
+    while True:
+        ids = [rating['_id'] for rating in
+               mongo.db.ratings.find({'sample_id': sample_id}, {'_id': 1}).limit(Config.JOB_BATCH_SIZE)]
+        if not ids:
+            break
+        deleted += mongo.db.ratings.delete_many({'_id': {'$in': ids}}).deleted_count
+        heartbeat(job, ratings=deleted)
+    # Again, in case a stats rebuild ran while the ratings were going
+    stats.remove_sample(sample_id)
+    mongo.db.samples.delete_one({'_id': sample_id, **DELETED})
+    versions.bump('samples', 'ratings')
+    logger.info(f"Purged sample {sample_id} and {deleted} ratings")
+
+def rebuild_stats(job):
+    if not stats.rebuild():
+        raise RuntimeError('Stats rebuild failed, see the worker log')
+
+def run_backup(job):
+    params = job['params']
+    directory = backup.backup_database(
+        params.get('root'),
+        params.get('incremental', False),
+        params.get('compress', True),
+        progress=lambda collection, count: heartbeat(job, **{collection: count})
+    )
+    if not directory:
+        raise RuntimeError('Backup failed, see the worker log')
+    mongo.db.jobs.update_one(owned(job), {'$set': {'result': directory}})
+
+HANDLERS = {
+    'purge_user': purge_user,
+    'purge_sample': purge_sample,
+    'rebuild_stats': rebuild_stats,
+    'backup': run_backup
+}
+
+PURGES = (('users', 'purge_user', 'user_id'), ('samples', 'purge_sample', 'sample_id'))
+
+def run_job(job):
+    try:
+        HANDLERS[job['type']](job)
+        finish(job)
+        return True
+    except LeaseLost:
+        logger.warning(f"Job {job['_id']} was taken over by another worker")
+    except Exception as e:
+        logger.error(f"Job {job['_id']} ({job['type']}) failed: {str(e)}")
+        fail(job, str(e))
+    return False
+
+def recover_tombstones():
+    # A tombstone whose purge job was never queued, e.g. because the request
+    # died in between, would stay hidden forever. Queue the missing jobs.
+    for collection, job_type, param in PURGES:
+        for doc in mongo.db[collection].find(DELETED, {'_id': 1}):
+            pending = mongo.db.jobs.find_one({
+                'type': job_type,
+                f'params.{param}': doc['_id'],
+                'status': {'$in': [QUEUED, RUNNING]}
+            }, {'_id': 1})
+            if not pending:
+                logger.info(f"Queueing missing {job_type} for {doc['_id']}")
+                enqueue(job_type, **{param: doc['_id']})
+
+def run_worker(once=False, poll=None):
+    # With once, exits when the queue is empty instead of polling for more
+    poll = Config.JOB_POLL_SECONDS if poll is None else poll
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    recover_tombstones()
+    logger.info(f"Job worker {worker} started")
+    processed = 0
+    while True:
+        job = claim(worker)
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll)
+            continue
+        logger.info(f"Running job {job['_id']} ({job['type']}, attempt {job['attempts']})")
+        if job['attempts'] > Config.JOB_MAX_ATTEMPTS:
+            # Its workers kept dying mid-job
+            fail(job, 'Worker lost too many times')
+            continue
+        run_job(job)
+        processed += 1
+
+def job_status():
+    return list(mongo.db.jobs.aggregate([
+        {'$group': {'_id': {'type': '$type', 'status': '$status'}, 'count': {'$sum': 1}}},
+        {'$sort': {'_id.type': 1, '_id.status': 1}}
+    ]))
+
+def main():
+    parser = argparse.ArgumentParser(description='Run or queue Rating Meter background jobs')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    worker = commands.add_parser('worker')
+    worker.add_argument('--once', action='store_true', help='exit when the queue is empty')
+
+    enqueue_job = commands.add_parser('enqueue')
+    enqueue_job.add_argument('type', choices=['rebuild_stats', 'backup'])
+    enqueue_job.add_argument('--dir', help='backup root (default: BACKUP_DIR)')
+    enqueue_job.add_argument('--incremental', action='store_true')
+    enqueue_job.add_argument('--no-compress', action='store_true')
+
+    commands.add_parser('status')
+
+    args = parser.parse_args()
+    if args.command == 'worker':
+        run_worker(args.once)
+    elif args.command == 'enqueue':
+        params = {}
+        if args.type == 'backup':
+            params = {'root': args.dir, 'incremental': args.incremental, 'compress': not args.no_compress}
+        print(enqueue(args.type, **params))
+    else:
+        for group in job_status():
+            print(f"{group['_id']['type']:<16}{group['_id']['status']:<10}{group['count']:>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+from bisect import bisect_left, insort
+import json
+import logging
+import threading
+import time
+
+from . import secondary_collection
+from .cache import make_backend
+from .config import Config
+from .tombstones import NOT_DELETED
+
+logger = logging.getLogger(__name__)
+
+class Leaderboard:
+    # Players kept sorted in process as (-points, username, id) tuples, so
+    # top-N is a slice and a rank is a binary search. It is loaded from Mongo
+    # on first use, kept current by the routes that change points, and
+    # reloaded every refresh_seconds to pick up writes from other workers.
+    def __init__(self, loader, refresh_seconds):
+        self.loader = loader
+        self.refresh_seconds = refresh_seconds
+        self._entries = []
+        self._by_id = {}
+        self._loaded_at = None
+        self._lock = threading.RLock()
+
+    def load(self, players):
+        entries = []
+        by_id = {}
+        for player in players:
+            entry = (-player.get('points', 0), player.get('username', ''), str(player['_id']))
+            entries.append(entry)
+            by_id[entry[2]] = entry
+        entries.sort()
+        with self._lock:
+            self._entries = entries
+            self._by_id = by_id
+            self._loaded_at = time.monotonic()
+        logger.info(f"Leaderboard loaded with {len(entries)} players")
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self.load(self.loader())
+
+    def _discard(self, user_id):
+        entry = self._by_id.pop(user_id, None)
+        if entry is not None:
+            index = bisect_left(self._entries, entry)
+            if index < len(self._entries) and self._entries[index] == entry:
+                del self._entries[index]
+
+    def set_points(self, user_id, username, points):
+        user_id = str(user_id)
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._discard(user_id)
+            entry = (-points, username, user_id)
+            insort(self._entries, entry)
+            self._by_id[user_id] = entry
+
+    def remove(self, user_id):
+        with self._lock:
+            self._discard(str(user_id))
+
+    def top(self, n=10):
+        with self._lock:
+            self._ensure_loaded()
+            return [
+                {'id': user_id, 'username': username, 'points': -points}
+                for points, username, user_id in self._entries[:n]
+            ]
+
+    def rank(self, points):
+        # Same semantics as counting players with more points, plus one
+        with self._lock:
+            self._ensure_loaded()
+            return bisect_left(self._entries, (-points,)) + 1
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._entries)
+
+def load_players():
+    return secondary_collection('users').find({'is_playmaker': False, **NOT_DELETED}, {'username': 1, 'points': 1})
+
+leaderboard = Leaderboard(load_players, Config.LEADERBOARD_REFRESH_SECONDS)
+
+# Short-lived cache of the top-N and of the page rendered for anonymous
+# visitors, so a projected leaderboard screen costs almost nothing.
+# Cleared whenever points change.
+response_cache = make_backend(Config.RESPONSE_CACHE_URL)
+PAGE_KEY = 'leaderboard:page'
+TOP_KEY = 'leaderboard:top:{}'
+CACHED_SIZES = (10,)
+
+def cached_top(n=10):
+    key = TOP_KEY.format(n)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    players = leaderboard.top(n)
+    response_cache.set(key, json.dumps(players), Config.LEADERBOARD_CACHE_TTL)
+    return players
+
+def cached_page(render):
+    page = response_cache.get(PAGE_KEY)
+    if page is None:
+        page = render()
+        response_cache.set(PAGE_KEY, page, Config.LEADERBOARD_CACHE_TTL)
+    return page
+
+def invalidate_cache():
+    response_cache.delete(PAGE_KEY, *[TOP_KEY.format(n) for n in CACHED_SIZES])
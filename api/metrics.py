@@ -0,0 +1,213 @@
+# Request-level performance instrumentation: route latency, MongoDB command
+# count and time (through a pymongo CommandListener) and template render
+# time, exposed in Prometheus text format at /api/metrics.
+from collections import defaultdict
+import contextvars
+import logging
+import threading
+import time
+
+from pymongo import monitoring
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Commands per request, fine enough at the low end to tell a route's usual
+# two or three commands from an N+1 loop
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+class Histogram:
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.buckets = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.buckets[i] += 1
+
+class Registry:
+    def __init__(self):
+        self.requests = defaultdict(Histogram)         # (route, method) -> seconds
+        self.responses = defaultdict(int)              # (route, method, status) -> count
+        self.request_commands = defaultdict(lambda: Histogram(COUNT_BUCKETS))  # (route, method) -> commands per request
+        self.commands = defaultdict(Histogram)         # (command,) -> seconds
+        self.command_failures = defaultdict(int)       # (command,) -> count
+        self.templates = defaultdict(Histogram)        # (template,) -> seconds
+        self.slow_queries = 0
+        self._lock = threading.Lock()
+
+    def observe(self, metric, labels, value):
+        with self._lock:
+            getattr(self, metric)[labels].observe(value)
+
+    def increment(self, metric, labels):
+        with self._lock:
+            getattr(self, metric)[labels] += 1
+
+registry = Registry()
+
+# Per-request counters, reset by the middleware. A context variable rather
+# than a thread local, so requests served side by side on one event loop
+# (api/asgi.py) keep separate counts; under WSGI each thread has its own
+# context. pymongo calls listeners on the thread that ran the command, which
+# for a sync view is the request's.
+class RequestTiming:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.template_seconds = 0.0
+
+current = contextvars.ContextVar('request_timing', default=None)
+template_start = contextvars.ContextVar('template_start', default=None)
+
+def start_request():
+    current.set(RequestTiming())
+
+def finish_request(route, method, status):
+    request_timing = current.get()
+    if request_timing is None:
+        return None
+    elapsed = time.perf_counter() - request_timing.started
+    labels = (route, method)
+    registry.observe('requests', labels, elapsed)
+    registry.observe('request_commands', labels, request_timing.mongo_commands)
+    registry.increment('responses', (route, method, str(status)))
+    timing = {
+        'total': elapsed,
+        'db': request_timing.mongo_seconds,
+        'db_commands': request_timing.mongo_commands,
+        'render': request_timing.template_seconds
+    }
+    current.set(None)
+    if elapsed * 1000 > Config.SLOW_REQUEST_MS:
+        logger.warning("Slow request %s %s: %.1f ms, %d Mongo commands (%.1f ms), render %.1f ms",
+                       method, route, elapsed * 1000, timing['db_commands'],
+                       timing['db'] * 1000, timing['render'] * 1000)
+    return timing
+
+class CommandTimer(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = None
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (collection, event.command)
+
+    def _finish(self, event, failed):
+        with self._lock:
+            collection, command = self._pending.pop((event.connection_id, event.request_id), (None, None))
+        seconds = event.duration_micros / 1e6
+        registry.observe('commands', (event.command_name,), seconds)
+        if failed:
+            registry.increment('command_failures', (event.command_name,))
+        request_timing = current.get()
+        if request_timing is not None:
+            request_timing.mongo_commands += 1
+            request_timing.mongo_seconds += seconds
+        if seconds * 1000 > Config.SLOW_QUERY_MS:
+            with registry._lock:
+                registry.slow_queries += 1
+            # Log the query shape (filter, pipeline, sort), never written documents
+            shape = {k: command.get(k) for k in ('filter', 'pipeline', 'sort', 'query') if command and k in command}
+            logger.warning("Slow Mongo command %s on %s: %.1f ms %s",
+                           event.command_name, collection, seconds * 1000, shape)
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+command_timer = CommandTimer()
+
+def template_started(sender, template, context, **extra):
+    template_start.set(time.perf_counter())
+
+def template_finished(sender, template, context, **extra):
+    started = template_start.get()
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    template_start.set(None)
+    registry.observe('templates', (template.name or 'inline',), seconds)
+    request_timing = current.get()
+    if request_timing is not None:
+        request_timing.template_seconds += seconds
+
+def label_string(names, values):
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+
+def render_histogram(lines, name, help_text, label_names, histograms):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, histogram in sorted(histograms.items()):
+        base = label_string(label_names, labels)
+        for bound, count in zip(histogram.bounds, histogram.buckets):
+            lines.append(f'{name}_bucket{{{base},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{base},le="+Inf"}} {histogram.count}')
+        lines.append(f'{name}_sum{{{base}}} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{{{base}}} {histogram.count}')
+
+def render_counter(lines, name, help_text, label_names, counters):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} counter')
+    for labels, value in sorted(counters.items()):
+        lines.append(f'{name}{{{label_string(label_names, labels)}}} {value}')
+
+def render():
+    lines = []
+    with registry._lock:
+        render_histogram(lines, 'rating_meter_request_duration_seconds', 'Request latency by route',
+                         ('route', 'method'), registry.requests)
+        render_histogram(lines, 'rating_meter_request_mongo_commands', 'MongoDB commands issued per request',
+                         ('route', 'method'), registry.request_commands)
+        render_counter(lines, 'rating_meter_responses_total', 'Responses by route and status',
+                       ('route', 'method', 'status'), registry.responses)
+        render_histogram(lines, 'rating_meter_mongo_command_duration_seconds', 'MongoDB command latency',
+                         ('command',), registry.commands)
+        render_counter(lines, 'rating_meter_mongo_command_failures_total', 'Failed MongoDB commands',
+                       ('command',), registry.command_failures)
+        render_histogram(lines, 'rating_meter_template_render_seconds', 'Template render time',
+                         ('template',), registry.templates)
+        lines.append('# HELP rating_meter_slow_mongo_commands_total Commands slower than SLOW_QUERY_MS')
+        lines.append('# TYPE rating_meter_slow_mongo_commands_total counter')
+        lines.append(f'rating_meter_slow_mongo_commands_total {registry.slow_queries}')
+    return '\n'.join(lines) + '\n'
+
+def init_app(app):
+    from flask import request, signals
+
+    @app.before_request
+    def start_timer():
+        start_request()
+
+    @app.after_request
+    def record_timing(response):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        timing = finish_request(route, request.method, response.status_code)
+        if timing:
+            response.headers['Server-Timing'] = (
+                f"db;desc=\"{timing['db_commands']} commands\";dur={timing['db'] * 1000:.1f}, "
+                f"render;dur={timing['render'] * 1000:.1f}, "
+                f"total;dur={timing['total'] * 1000:.1f}"
+            )
+        return response
+
+    # Flask only sends template signals when blinker is installed
+    if signals.signals_available:
+        signals.before_render_template.connect(template_started, app)
+        signals.template_rendered.connect(template_finished, app)
+    else:
+        logger.info("blinker not installed, template render time is not recorded")
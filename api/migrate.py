@@ -0,0 +1,74 @@
+# One-off database migrations, kept out of the request path so cold starts
+# don't pay for them. Run after deploying a change that needs new indexes:
+#
+#   python -m api.migrate
+import logging
+
+from pymongo.errors import PyMongoError
+
+from . import mongo
+from . import stats
+from .indexes import create_indexes, undeclared_indexes
+
+logger = logging.getLogger(__name__)
+
+RATING_KEY = [('user_id', 1), ('sample_id', 1)]
+
+def remove_duplicate_ratings(db):
+    # Before the unique index a double submission could store two ratings
+    # for the same sample. Keeps the first one and takes the later ones'
+    # points back off the player and out of the sample stats.
+    duplicates = db.ratings.aggregate([
+        {'$group': {'_id': {'user_id': '$user_id', 'sample_id': '$sample_id'}, 'ids': {'$push': '$_id'}}},
+        {'$match': {'ids.1': {'$exists': True}}}
+    ], allowDiskUse=True)
+    removed = 0
+    for group in duplicates:
+        extra = sorted(group['ids'])[1:]
+        ratings = list(db.ratings.find({'_id': {'$in': extra}}, {'sample_id': 1, 'rating_value': 1, 'points_earned': 1}))
+        db.ratings.delete_many({'_id': {'$in': extra}})
+        db.users.update_one({'_id': group['_id']['user_id']},
+                            {'$inc': {'points': -sum(rating['points_earned'] for rating in ratings)}})
+        stats.remove_ratings(ratings)
+        removed += len(ratings)
+    if removed:
+        logger.warning(f"Removed {removed} duplicate ratings")
+    return removed
+
+def make_ratings_unique(db):
+    # Older releases created (user_id, sample_id) without unique, and
+    # createIndex won't change the options of an existing index
+    indexes = db.ratings.index_information()
+    if any(info['key'] == RATING_KEY and info.get('unique') for info in indexes.values()):
+        return
+    remove_duplicate_ratings(db)
+    for name, info in indexes.items():
+        if info['key'] == RATING_KEY:
+            db.ratings.drop_index(name)
+            logger.info(f"Dropped non-unique index ratings.{name}")
+
+def setup_mongodb_indexes():
+    try:
+        try:
+            make_ratings_unique(mongo.db)
+        except PyMongoError as e:
+            logger.error(f"Error migrating the ratings index: {str(e)}")
+        # Every index is declared in api/indexes.py
+        failed = create_indexes(mongo.db)
+        for collection, keys, error in failed:
+            logger.error(f"Error creating index {collection} {keys}: {error}")
+        for collection, name in undeclared_indexes(mongo.db):
+            logger.warning(f"Index {collection}.{name} is not declared in api/indexes.py and can probably be dropped")
+        if failed:
+            return False
+        logger.info("MongoDB indexes created successfully")
+        return True
+    except Exception as e:
+        logger.error(f"Error creating MongoDB indexes: {str(e)}")
+        return False
+
+def main():
+    raise SystemExit(0 if setup_mongodb_indexes() else 1)
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,28 @@ from datetime import datetime
 from bson import ObjectId
 from flask_login import UserMixin
 
+from .cache import TTLCache
+from .config import Config
+
+# User documents keyed by string id, shared by load_user and the routes that
+# change a user. Entries are copied in and out so request-local changes to a
+# User never leak into the cache.
+user_cache = TTLCache(Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)
+
 class User(UserMixin):
     def __init__(self, user_data):
         if user_data is None:
             raise ValueError("User data cannot be None")
         self.user_data = user_data
 
+    @classmethod
+    def cached(cls, user_id):
+        user_data = user_cache.get(user_id)
+        return cls(dict(user_data)) if user_data else None
+
+    def remember(self):
+        user_cache.set(self.id, dict(self.user_data))
+
     @property
     def is_active(self):
         return True
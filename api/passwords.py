@@ -0,0 +1,90 @@
+# Password hashing off the request thread. PBKDF2 is deliberately slow, so
+# hashes run in a small thread pool (hashlib releases the GIL while it
+# works) and at most PASSWORD_HASH_QUEUE of them can be queued at once. A
+# registration burst then queues or is turned away with a busy message
+# instead of pinning every worker thread on CPU.
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+from . import mongo
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class HashingBusy(Exception):
+    pass
+
+def normalize_method(method):
+    # Werkzeug records the iteration count in the hash even when the method
+    # leaves it out, so compare against the fully spelled out form
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2' and len(parts) == 2:
+        parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ':'.join(parts)
+
+class PasswordHasher:
+    def __init__(self, method, salt_length, workers, queue_size, timeout):
+        self.method = normalize_method(method)
+        self.salt_length = salt_length
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashingBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length).result()
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password).result()
+
+    def needs_rehash(self, password_hash):
+        method, _, rest = password_hash.partition('$')
+        salt = rest.partition('$')[0]
+        return method != self.method or len(salt) != self.salt_length
+
+    def upgrade(self, user_id, password_hash, password):
+        # Re-hashes with the current settings after a successful login. Runs
+        # in the background so the login doesn't pay for a second hash, and
+        # only replaces the hash the password was just checked against.
+        def rehash():
+            new_hash = generate_password_hash(password, self.method, self.salt_length)
+            mongo.db.users.update_one(
+                {'_id': user_id, 'password_hash': password_hash},
+                {'$set': {'password_hash': new_hash}}
+            )
+            return new_hash
+
+        def done(future):
+            if future.exception():
+                logger.error(f"Password hash upgrade failed: {str(future.exception())}")
+            else:
+                logger.info("Upgraded password hash for user %s", user_id)
+
+        try:
+            self._run(rehash).add_done_callback(done)
+        except HashingBusy:
+            # Try again on the next login
+            pass
+
+hasher = PasswordHasher(
+    Config.PASSWORD_HASH_METHOD,
+    Config.PASSWORD_SALT_LENGTH,
+    Config.PASSWORD_HASH_WORKERS,
+    Config.PASSWORD_HASH_QUEUE,
+    Config.PASSWORD_HASH_TIMEOUT
+)
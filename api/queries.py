@@ -0,0 +1,107 @@
+# Aggregation pipelines shared by the dashboard views.
+# Joins are done server-side with $lookup so a page costs a fixed number of
+# round trips no matter how many ratings it shows.
+from .tombstones import tombstones, NOT_DELETED
+
+DATE_FORMAT = '%Y-%m-%d %H:%M'
+
+def page_query(before=None, query=None):
+    # Keyset pagination: pages are walked newest first by _id
+    query = dict(query or {})
+    if before:
+        query['_id'] = {'$lt': before}
+    return query
+
+def split_page(docs, limit):
+    # Callers fetch limit + 1 documents so we know whether another page exists
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return docs, str(docs[-1]['_id'])
+    return docs, None
+
+def rating_details_pipeline(match=None, limit=None, with_user=True, with_sample=True, require_sample=False):
+    pipeline = []
+    if match:
+        pipeline.append({'$match': match})
+    pipeline.append({'$sort': {'_id': -1}})
+    if limit:
+        pipeline.append({'$limit': limit})
+
+    project = {
+        'user_id': 1,
+        'sample_id': 1,
+        'rating_value': 1,
+        'points_earned': 1,
+        'created_at': 1,
+        'formatted_date': {'$dateToString': {'format': DATE_FORMAT, 'date': '$created_at'}}
+    }
+
+    if with_user:
+        pipeline += [
+            {'$lookup': {
+                'from': 'users',
+                'localField': 'user_id',
+                'foreignField': '_id',
+                'as': 'user'
+            }},
+            {'$unwind': {'path': '$user', 'preserveNullAndEmptyArrays': True}}
+        ]
+        project['user'] = {
+            'username': {'$ifNull': ['$user.username', 'Unknown User']},
+            'points': {'$ifNull': ['$user.points', 0]}
+        }
+
+    # Callers holding the sample catalog join samples in process instead.
+    # require_sample drops ratings whose sample has since been deleted.
+    if with_sample:
+        pipeline += [
+            {'$lookup': {
+                'from': 'samples',
+                'localField': 'sample_id',
+                'foreignField': '_id',
+                'as': 'sample'
+            }},
+            {'$unwind': {'path': '$sample', 'preserveNullAndEmptyArrays': not require_sample}}
+        ]
+        project['sample'] = {
+            'name': {'$ifNull': ['$sample.name', 'Unknown Sample']},
+            'playmaker_rating': {'$ifNull': ['$sample.playmaker_rating', 0]}
+        }
+
+    pipeline.append({'$project': project})
+    return pipeline
+
+# Dashboard lists and the player dashboard. The WSGI views (api/index.py,
+# api/v1.py) and the async ones (api/asgi.py) run exactly these queries and
+# only differ in how they wait for them.
+
+def samples_page(samples, before, limit):
+    # Samples come from the catalog, already newest first
+    return split_page([s for s in samples if before is None or s['_id'] < before][:limit + 1], limit)
+
+def with_stats(samples, sample_stats):
+    # Copy so per-page stats never end up in the shared catalog
+    return [dict(s, stats=sample_stats[s['_id']]) for s in samples]
+
+def ratings_page_pipeline(before, limit):
+    return rating_details_pipeline(tombstones.visible_ratings(page_query(before)), limit + 1, with_sample=False)
+
+def own_ratings_page_pipeline(user_id, before, limit):
+    query = tombstones.visible_ratings(page_query(before, {'user_id': user_id}))
+    return rating_details_pipeline(query, limit + 1, with_user=False, with_sample=False)
+
+def players_page_find(before, limit):
+    # Keyword arguments for find()
+    return {
+        'filter': page_query(before, {'is_playmaker': False, **NOT_DELETED}),
+        'projection': {'password_hash': 0},
+        'sort': [('_id', -1)],
+        'limit': limit + 1
+    }
+
+def player_ratings_pipeline(user_id):
+    return rating_details_pipeline({'user_id': user_id}, with_user=False, with_sample=False)
+
+def unrated_samples(samples, ratings):
+    rated_sample_ids = {rating['sample_id'] for rating in ratings}
+    return [s for s in samples if s['_id'] not in rated_sample_ids]
@@ -0,0 +1,113 @@
+# Per-sample rating statistics, kept in the sample_stats collection as
+# running sums so the dashboard reads one small document per sample instead
+# of re-scanning ratings. Rebuild from scratch if they ever drift:
+#
+#   python -m api.stats
+from collections import defaultdict
+import logging
+import math
+
+from pymongo import UpdateOne
+
+from . import mongo
+from .tombstones import tombstones
+
+logger = logging.getLogger(__name__)
+
+def increments(rating_value, points, sign=1):
+    return {
+        'count': sign,
+        'sum_rating': sign * rating_value,
+        'sum_rating_sq': sign * rating_value * rating_value,
+        'sum_points': sign * points
+    }
+
+def record_rating(sample_id, rating_value, points):
+    mongo.db.sample_stats.update_one(
+        {'_id': sample_id},
+        {'$inc': increments(rating_value, points)},
+        upsert=True
+    )
+
+def record_ratings(ratings, sign=1):
+    # One upsert per sample, however many of its ratings are in the batch.
+    # Summing from int 0 keeps count an int; the other fields turn float.
+    totals = defaultdict(lambda: defaultdict(int))
+    for rating in ratings:
+        for field, value in increments(rating['rating_value'], rating['points_earned'], sign).items():
+            totals[rating['sample_id']][field] += value
+    if totals:
+        mongo.db.sample_stats.bulk_write([
+            UpdateOne({'_id': sample_id}, {'$inc': dict(fields)}, upsert=sign > 0)
+            for sample_id, fields in totals.items()
+        ], ordered=False)
+
+def remove_ratings(ratings):
+    # Subtracts a batch of deleted ratings; samples without stats are skipped
+    record_ratings(ratings, sign=-1)
+
+def group_stage():
+    return {'$group': {
+        '_id': '$sample_id',
+        'count': {'$sum': 1},
+        'sum_rating': {'$sum': '$rating_value'},
+        'sum_rating_sq': {'$sum': {'$multiply': ['$rating_value', '$rating_value']}},
+        'sum_points': {'$sum': '$points_earned'}
+    }}
+
+def remove_user(user_id):
+    # Takes all of a tombstoned user's ratings out of the stats at once, so
+    # the dashboard stops counting them before the purge job deletes them
+    docs = list(mongo.db.ratings.aggregate([{'$match': {'user_id': user_id}}, group_stage()]))
+    if docs:
+        mongo.db.sample_stats.bulk_write([
+            UpdateOne({'_id': doc['_id']}, {'$inc': {field: -value for field, value in doc.items() if field != '_id'}})
+            for doc in docs
+        ], ordered=False)
+
+def remove_sample(sample_id):
+    mongo.db.sample_stats.delete_one({'_id': sample_id})
+
+def summarize(doc):
+    count = doc.get('count', 0) if doc else 0
+    if count <= 0:
+        return {'count': 0, 'average': None, 'spread': None, 'average_points': None}
+    average = doc['sum_rating'] / count
+    variance = max(0.0, doc['sum_rating_sq'] / count - average * average)
+    return {
+        'count': int(count),
+        'average': round(average, 2),
+        'spread': round(math.sqrt(variance), 2),
+        'average_points': round(doc['sum_points'] / count, 2)
+    }
+
+def stats_query(sample_ids):
+    return {'_id': {'$in': list(sample_ids)}}
+
+def summaries(sample_ids, docs):
+    docs = {doc['_id']: doc for doc in docs}
+    return {sample_id: summarize(docs.get(sample_id)) for sample_id in sample_ids}
+
+def stats_for(sample_ids):
+    return summaries(sample_ids, mongo.db.sample_stats.find(stats_query(sample_ids)))
+
+def rebuild():
+    try:
+        # Ratings of tombstoned users and samples are no longer counted
+        tombstones.invalidate()
+        mongo.db.ratings.aggregate([
+            {'$match': tombstones.visible_ratings({})},
+            group_stage(),
+            {'$out': 'sample_stats'}
+        ])
+        logger.info(f"Rebuilt stats for {mongo.db.sample_stats.count_documents({})} samples")
+        return True
+    except Exception as e:
+        logger.error(f"Error rebuilding sample stats: {str(e)}")
+        return False
+
+def main():
+    raise SystemExit(0 if rebuild() else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+def test_current_formula_matches_calculate_points():
+    from api.analytics import SCORING
+    from api.utils import calculate_points
+
+    ratings = np.round(np.arange(0, 10.01, 0.1), 1)
+    for playmaker_rating in (0.0, 3.3, 5.0, 7.5, 10.0):
+        points = SCORING['current'](np.abs(ratings - playmaker_rating))
+        assert list(points) == [calculate_points(playmaker_rating, r) for r in ratings]
+
+def test_analyze_groups_by_user_and_sample():
+    from api.analytics import RatingArrays, analyze
+
+    ratings = RatingArrays(
+        ['a', 'b'], ['x', 'y'],
+        np.array([0, 0, 1]), np.array([0, 1, 0]),
+        np.array([6.0, 2.0, 5.0]), np.array([5.0, 4.0, 5.0])
+    )
+    result = analyze(ratings)
+
+    users = result['users']
+    assert list(users['count']) == [2, 1]
+    assert list(users['mae']) == [1.5, 0.0]
+    assert list(users['bias']) == [-0.5, 0.0]
+    assert list(users['consistency']) == [1.5, 0.0]
+    assert list(users['points']['current']) == [14, 10]
+    assert list(users['rank']['current']) == [1, 2]
+    assert list(result['samples']['mean_rating']) == [5.5, 2.0]
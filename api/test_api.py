@@ -0,0 +1,98 @@
+from datetime import datetime
+import time
+
+def test_leaderboard_etag_skips_queries_until_points_change(db, app, login, counter, make_user, make_samples):
+    user_id = make_user()
+    sample_id = make_samples(1)[0]
+    client = app.test_client()
+    etag = client.get('/api/v1/leaderboard').headers['ETag']
+
+    counter.clear()
+    response = client.get('/api/v1/leaderboard', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert counter.commands == []
+
+    login(user_id).post(f'/rate_sample/{sample_id}', data={'rating': '5'})
+    response = client.get('/api/v1/leaderboard', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['items'][0]['points'] == 10
+
+def test_samples_etag_follows_the_cached_body(db, app, login, make_user, make_samples):
+    from api.catalog import catalog
+    from api.versions import versions
+
+    user_id = make_user()
+    client = login(user_id)
+    first = client.get('/api/v1/samples')
+
+    # Another worker adds a sample; this worker's catalog hasn't reloaded yet
+    make_samples(1)
+    versions.bump('samples')
+    response = client.get('/api/v1/samples', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 304
+
+    catalog.invalidate()
+    response = client.get('/api/v1/samples', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert [item['name'] for item in response.get_json()['items']] == ['sample0']
+
+def test_login_upgrades_outdated_password_hash(db, app):
+    from werkzeug.security import generate_password_hash
+    from api.passwords import hasher
+
+    old_hash = generate_password_hash('secret', 'pbkdf2:sha256:1000', 8)
+    user_id = db.users.insert_one({
+        'username': 'player', 'password_hash': old_hash, 'is_playmaker': False,
+        'points': 0, 'created_at': datetime.utcnow()
+    }).inserted_id
+
+    response = app.test_client().post('/login', data={'username': 'player', 'password': 'secret'})
+    assert response.status_code == 302
+
+    # The upgrade runs in the background after the login returns
+    deadline = time.monotonic() + 10
+    while db.users.find_one({'_id': user_id})['password_hash'] == old_hash and time.monotonic() < deadline:
+        time.sleep(0.05)
+    new_hash = db.users.find_one({'_id': user_id})['password_hash']
+    assert new_hash.startswith(hasher.method + '$')
+    assert not hasher.needs_rehash(new_hash)
+    assert hasher.verify(new_hash, 'secret')
+
+def test_commands_per_request_use_count_buckets():
+    from api import metrics
+
+    metrics.registry.observe('request_commands', ('/test-route', 'GET'), 41)
+    lines = metrics.render().splitlines()
+    assert 'rating_meter_request_mongo_commands_bucket{route="/test-route",method="GET",le="20"} 0' in lines
+    assert 'rating_meter_request_mongo_commands_bucket{route="/test-route",method="GET",le="50"} 1' in lines
+
+def test_cache_stats_need_a_playmaker(db, app, login, make_user):
+    player_id = make_user()
+    playmaker_id = make_user('playmaker', is_playmaker=True)
+
+    assert app.test_client().get('/api/cache-stats').status_code == 401
+    assert login(player_id).get('/api/cache-stats').status_code == 403
+    assert login(playmaker_id).get('/api/cache-stats').get_json()['status'] == 'success'
+
+def test_anonymous_leaderboard_with_a_flashed_message(db, app):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_flashes'] = [('message', 'Registration successful')]
+
+    response = client.get('/leaderboard')
+    assert response.status_code == 200
+    assert b'Registration successful' in response.data
+    assert 'private' in response.headers['Cache-Control']
+
+def test_leaderboard_polls_unless_streaming_is_on(db, app, login, monkeypatch, make_user):
+    user_id = make_user()
+    client = login(user_id)
+
+    page = client.get('/leaderboard').data
+    assert b'EventSource(' not in page
+    assert b'/api/v1/leaderboard?limit=10' in page
+
+    monkeypatch.setitem(app.jinja_env.globals, 'events_streaming', True)
+    page = client.get('/leaderboard').data
+    assert b'EventSource(' in page
+    assert b'/api/v1/leaderboard?limit=10' not in page
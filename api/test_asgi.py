@@ -0,0 +1,63 @@
+import asyncio
+import functools
+import time
+
+import pytest
+
+pytest.importorskip('asgiref')
+try:
+    # Motor 2.5 is installed but fails to import on Python 3.11+
+    import motor.motor_asyncio
+except ImportError as e:
+    pytest.skip(f"Async mode unavailable: {e}", allow_module_level=True)
+
+async def call(application, path):
+    # One GET through an ASGI app, returning the status and the body chunks
+    response = {'body': []}
+
+    async def receive():
+        if 'requested' not in response:
+            response['requested'] = True
+            return {'type': 'http.request', 'body': b''}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message.get('body'):
+            response['body'].append(message['body'])
+
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost')], 'http_version': '1.1', 'scheme': 'http',
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 1)
+    }
+    await application(scope, receive, send)
+    return response
+
+def test_fallback_request_finishes_while_streams_are_open(monkeypatch):
+    from api import asgi, events
+
+    monkeypatch.setattr(events, 'stream', functools.partial(events.stream, heartbeat=0.1, duration=1))
+    monkeypatch.setattr(events, 'async_stream', functools.partial(events.async_stream, heartbeat=0.1, duration=1))
+
+    async def run():
+        # One stream on the loop, and one left to the WSGI app as any other
+        # slow fallback route would be
+        streams = [
+            asyncio.ensure_future(call(asgi.application, '/api/events')),
+            asyncio.ensure_future(call(asgi.flask_app, '/api/events'))
+        ]
+        await asyncio.sleep(0.2)
+        started = time.perf_counter()
+        response = await call(asgi.application, '/api/test')
+        elapsed = time.perf_counter() - started
+        return response, elapsed, await asyncio.gather(*streams)
+
+    response, elapsed, streams = asyncio.run(run())
+    assert response['status'] == 200
+    assert elapsed < 0.5
+    for stream in streams:
+        assert stream['status'] == 200
+        assert stream['body'][0] == b'retry: 3000\n\n'
+        assert b': keepalive\n\n' in stream['body']
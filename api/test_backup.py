@@ -0,0 +1,40 @@
+def test_full_and_delta_restore_leaves_out_deleted_documents(db, clear, login, tmp_path,
+                                                             make_user, make_samples, rate):
+    from api import backup, jobs
+
+    playmaker_id = make_user('playmaker', is_playmaker=True)
+    kept_id = make_user('kept')
+    gone_id = make_user('gone')
+    kept_sample, gone_sample = make_samples(2)
+    rate(kept_id, [kept_sample, gone_sample])
+    rate(gone_id, [kept_sample])
+    assert backup.backup_database(str(tmp_path), compress=False)
+
+    # After the full backup: a new rating, then a user and a sample deleted
+    new_sample = make_samples(1, 'new')[0]
+    rate(kept_id, [new_sample])
+    client = login(playmaker_id)
+    client.post('/delete_user/gone')
+    client.get(f'/delete_sample/{gone_sample}')
+    jobs.run_worker(once=True, poll=0)
+    assert backup.backup_database(str(tmp_path), incremental=True)
+
+    expected = {
+        'users': sorted(user['username'] for user in db.users.find()),
+        'samples': sorted(sample['name'] for sample in db.samples.find()),
+        'ratings': sorted((rating['user_id'], rating['sample_id']) for rating in db.ratings.find()),
+        'points': db.users.find_one({'_id': kept_id})['points']
+    }
+    assert expected['users'] == ['kept', 'playmaker']
+    assert expected['samples'] == ['new0', 'sample0']
+
+    clear()
+    assert backup.restore_database(str(tmp_path))
+    assert sorted(user['username'] for user in db.users.find()) == expected['users']
+    assert sorted(sample['name'] for sample in db.samples.find()) == expected['samples']
+    assert sorted((rating['user_id'], rating['sample_id']) for rating in db.ratings.find()) == expected['ratings']
+    assert db.users.find_one({'_id': kept_id})['points'] == expected['points']
+
+    # Restoring again is harmless
+    assert backup.restore_database(str(tmp_path))
+    assert db.ratings.count_documents({}) == len(expected['ratings'])
@@ -0,0 +1,50 @@
+import pytest
+
+@pytest.fixture
+def seed(make_user, make_samples, rate):
+    # A playmaker and players who have rated every sample
+    def seed(n_players, n_samples):
+        playmaker_id = make_user('playmaker', is_playmaker=True)
+        sample_ids = make_samples(n_samples)
+        for i in range(n_players):
+            rate(make_user(f'player{i}'), sample_ids)
+        return playmaker_id
+    return seed
+
+def dashboard_commands(login, counter, user_id):
+    client = login(user_id)
+    counter.clear()
+    response = client.get('/dashboard')
+    assert response.status_code == 200
+    return list(counter.commands)
+
+def test_playmaker_dashboard_query_count_is_constant(db, clear, login, counter, seed):
+    small = dashboard_commands(login, counter, seed(2, 2))
+    clear()
+    large = dashboard_commands(login, counter, seed(6, 8))
+
+    assert len(small) == len(large)
+    assert 'getMore' not in large
+    assert large.count('find') <= 3
+
+def test_player_dashboard_query_count_is_constant(db, clear, login, counter, seed):
+    seed(1, 2)
+    light = db.users.find_one({'username': 'player0'})['_id']
+    small = dashboard_commands(login, counter, light)
+    clear()
+    seed(1, 40)
+    heavy = db.users.find_one({'username': 'player0'})['_id']
+    large = dashboard_commands(login, counter, heavy)
+
+    assert len(small) == len(large)
+    assert 'getMore' not in large
+
+def test_warm_dashboards_do_not_read_samples(db, login, counter, seed):
+    playmaker_id = seed(2, 3)
+    player_id = db.users.find_one({'username': 'player0'})['_id']
+    dashboard_commands(login, counter, playmaker_id)
+
+    dashboard_commands(login, counter, playmaker_id)
+    assert 'samples' not in counter.collections
+    dashboard_commands(login, counter, player_id)
+    assert 'samples' not in counter.collections
@@ -1,10 +1,12 @@
 from pymongo import MongoClient
 import os
 
+from api.config import Config
+
 def test_connection():
     uri = os.environ.get('MONGODB_URI')
     try:
-        client = MongoClient(uri)
+        client = MongoClient(uri, **Config.mongo_client_options())
         db = client.get_database()
         db.command('ping')
         print("Successfully connected to MongoDB!")
@@ -0,0 +1,48 @@
+def test_every_registered_query_uses_an_index(db):
+    from api.indexes import seed, audit
+
+    seed(db)
+    assert [(result['name'], result['stages']) for result in audit(db) if result['failed']] == []
+
+def test_undeclared_indexes_are_reported(db):
+    from api.indexes import undeclared_indexes
+
+    assert undeclared_indexes(db) == []
+    db.ratings.create_index([('points_earned', 1)])
+    try:
+        assert undeclared_indexes(db) == [('ratings', 'points_earned_1')]
+    finally:
+        db.ratings.drop_index('points_earned_1')
+
+def test_index_conflict_does_not_stop_the_others(db):
+    from api.indexes import create_indexes
+
+    db.jobs.drop_indexes()
+    db.jobs.create_index([('finished_at', 1)], expireAfterSeconds=1)
+    try:
+        failed = create_indexes(db)
+        assert [(collection, keys) for collection, keys, _ in failed] == [('jobs', [('finished_at', 1)])]
+        assert 'status_1_created_at_1' in db.jobs.index_information()
+        assert 'type_1_status_1' in db.jobs.index_information()
+    finally:
+        db.jobs.drop_index('finished_at_1')
+        assert create_indexes(db) == []
+
+def test_winning_stages_reads_every_explain_layout():
+    from api.indexes import winning_stages, plan_problems
+
+    classic = {'queryPlanner': {
+        'winningPlan': {'stage': 'LIMIT', 'inputStage': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}},
+        'rejectedPlans': [{'stage': 'COLLSCAN'}]
+    }, 'command': {'find': 'users', 'sort': {'$sort': 1}}}
+    slot_based = {'queryPlanner': {'winningPlan': {'queryPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}},
+                                                   'slotBasedPlan': {'stages': '[1] scan'}}}}
+    aggregate = {'stages': [
+        {'$cursor': {'queryPlanner': {'winningPlan': {'stage': 'IXSCAN'}}}},
+        {'$sort': {'sortKey': {'_id': -1}}}
+    ], 'command': {'pipeline': [{'$sort': {'_id': -1}}]}}
+
+    assert winning_stages(classic) == ['LIMIT', 'FETCH', 'IXSCAN']
+    assert plan_problems(winning_stages(classic)) == []
+    assert plan_problems(winning_stages(slot_based)) == ['COLLSCAN', 'in-memory SORT']
+    assert winning_stages(aggregate) == ['IXSCAN', 'SORT']
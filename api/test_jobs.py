@@ -0,0 +1,83 @@
+from datetime import datetime
+
+def test_deleted_user_is_hidden_then_purged_in_batches(db, login, monkeypatch, make_user, make_samples, rate):
+    from api import jobs, stats
+    from api.config import Config
+
+    playmaker_id = make_user('playmaker', is_playmaker=True)
+    player_id = make_user()
+    sample_ids = make_samples(5)
+    rate(player_id, sample_ids)
+    stats.rebuild()
+    client = login(playmaker_id)
+
+    other_id = make_user('other', points=10)
+    db.ratings.insert_one({'user_id': other_id, 'sample_id': sample_ids[0], 'rating_value': 7.0,
+                           'points_earned': 10, 'created_at': datetime.utcnow()})
+    stats.record_rating(sample_ids[0], 7.0, 10)
+
+    client.post('/delete_user/player')
+
+    # Hidden at once, stats included, purged later
+    assert db.users.count_documents({'_id': player_id}) == 1
+    assert db.ratings.count_documents({'user_id': player_id}) == 5
+    assert stats.stats_for(sample_ids)[sample_ids[0]]['count'] == 1
+    assert stats.stats_for(sample_ids)[sample_ids[0]]['average'] == 7.0
+    assert stats.stats_for(sample_ids)[sample_ids[1]]['count'] == 0
+    stats.rebuild()
+    assert stats.stats_for(sample_ids)[sample_ids[0]]['count'] == 1
+    assert [item['id'] for item in client.get('/api/v1/leaderboard').get_json()['items']] == [str(other_id)]
+    assert [item['username'] for item in client.get('/api/dashboard/users').get_json()['items']] == ['other']
+    assert len(client.get('/api/dashboard/ratings').get_json()['items']) == 1
+
+    monkeypatch.setattr(Config, 'JOB_BATCH_SIZE', 2)
+    assert jobs.run_worker(once=True, poll=0) == 1
+
+    assert db.users.count_documents({'_id': player_id}) == 0
+    assert db.ratings.count_documents({'user_id': player_id}) == 0
+    assert db.jobs.find_one({'type': 'purge_user'})['status'] == jobs.DONE
+    assert db.jobs.find_one({'type': 'purge_user'})['progress']['ratings'] == 5
+    assert stats.stats_for(sample_ids)[sample_ids[0]]['count'] == 1
+
+def test_deleted_sample_is_hidden_then_purged(db, login, make_user, make_samples, rate):
+    from api import jobs
+
+    playmaker_id = make_user('playmaker', is_playmaker=True)
+    player_id = make_user()
+    sample_ids = make_samples(2)
+    rate(player_id, sample_ids)
+    login(playmaker_id).get(f'/delete_sample/{sample_ids[0]}')
+
+    items = login(player_id).get('/api/v1/samples').get_json()['items']
+    assert [item['_id'] for item in items] == [str(sample_ids[1])]
+    ratings = login(player_id).get('/api/v1/ratings').get_json()['items']
+    assert [rating['sample_id'] for rating in ratings] == [str(sample_ids[1])]
+
+    jobs.run_worker(once=True, poll=0)
+    assert db.samples.count_documents({'_id': sample_ids[0]}) == 0
+    assert db.ratings.count_documents({'sample_id': sample_ids[0]}) == 0
+    assert db.ratings.count_documents({'sample_id': sample_ids[1]}) == 1
+
+def test_failed_job_is_retried_later(db, monkeypatch):
+    from api import jobs
+
+    monkeypatch.setattr(jobs.stats, 'rebuild', lambda: False)
+    job_id = jobs.enqueue('rebuild_stats')
+    jobs.run_worker(once=True, poll=0)
+
+    job = db.jobs.find_one({'_id': job_id})
+    assert job['status'] == jobs.QUEUED
+    assert job['attempts'] == 1
+    assert job['run_after'] > datetime.utcnow()
+
+def test_watched_catalog_drops_tombstoned_sample():
+    from api.catalog import SampleCatalog
+
+    catalog = SampleCatalog(ttl=60)
+    catalog._samples = {1: {'_id': 1, 'name': 'kept'}, 2: {'_id': 2, 'name': 'deleted'}}
+    catalog._apply({
+        'operationType': 'update',
+        'documentKey': {'_id': 2},
+        'fullDocument': {'_id': 2, 'name': 'deleted', 'deleted_at': datetime.utcnow()}
+    })
+    assert list(catalog._samples) == [1]
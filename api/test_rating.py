@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+def test_concurrent_ratings_keep_every_point(db, login, make_user, make_samples):
+    user_id = make_user()
+    sample_ids = make_samples(20)
+
+    def rate(sample_id):
+        return login(user_id).post(f'/rate_sample/{sample_id}', data={'rating': '5'}).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert set(pool.map(rate, sample_ids)) == {302}
+
+    assert db.users.find_one({'_id': user_id})['points'] == 10 * len(sample_ids)
+    assert db.ratings.count_documents({'user_id': user_id}) == len(sample_ids)
+
+def test_duplicate_rating_is_rejected(db, login, make_user, make_samples):
+    user_id = make_user()
+    sample_id = make_samples(1)[0]
+    client = login(user_id)
+
+    client.post(f'/rate_sample/{sample_id}', data={'rating': '5'})
+    client.post(f'/rate_sample/{sample_id}', data={'rating': '5'})
+
+    assert db.ratings.count_documents({'user_id': user_id}) == 1
+    assert db.users.find_one({'_id': user_id})['points'] == 10
+
+def test_migration_replaces_legacy_ratings_index(db, make_user, make_samples):
+    from api.migrate import setup_mongodb_indexes
+
+    user_id = make_user()
+    sample_id = make_samples(1)[0]
+    db.ratings.drop_index('user_id_1_sample_id_1')
+    db.ratings.create_index([('user_id', 1), ('sample_id', 1)])
+    db.users.update_one({'_id': user_id}, {'$set': {'points': 20}})
+    first = db.ratings.insert_one({'user_id': user_id, 'sample_id': sample_id, 'rating_value': 5.0,
+                                   'points_earned': 10, 'created_at': datetime.utcnow()}).inserted_id
+    db.ratings.insert_one({'user_id': user_id, 'sample_id': sample_id, 'rating_value': 5.0,
+                           'points_earned': 10, 'created_at': datetime.utcnow()})
+
+    assert setup_mongodb_indexes()
+    assert db.ratings.index_information()['user_id_1_sample_id_1'].get('unique')
+    assert [rating['_id'] for rating in db.ratings.find()] == [first]
+    assert db.users.find_one({'_id': user_id})['points'] == 10
+
+def test_rating_does_not_query_samples(db, login, counter, make_user, make_samples):
+    user_id = make_user()
+    sample_ids = make_samples(2)
+    client = login(user_id)
+    client.post(f'/rate_sample/{sample_ids[0]}', data={'rating': '5'})
+
+    counter.clear()
+    client.post(f'/rate_sample/{sample_ids[1]}', data={'rating': '5'})
+
+    assert counter.commands.count('insert') == 1
+    assert counter.commands.count('findAndModify') == 1
+    assert 'update' not in counter.commands
+
+def test_bulk_ratings_report_per_item_errors(db, login, make_user, make_samples):
+    user_id = make_user()
+    sample_ids = make_samples(4)
+    playmaker_id = make_user('playmaker', is_playmaker=True)
+    items = [{'user_id': str(user_id), 'sample_id': str(s), 'rating': 5} for s in sample_ids[:3]]
+    items.append({'user_id': str(user_id), 'sample_id': str(sample_ids[0]), 'rating': 5})
+    items.append({'user_id': str(user_id), 'sample_id': 'not-an-id', 'rating': 5})
+    items.append({'user_id': str(user_id), 'sample_id': str(sample_ids[3]), 'rating': True})
+
+    response = login(playmaker_id).post('/api/ratings/bulk', json={'ratings': items})
+    body = response.get_json()
+
+    assert body['stored'] == 3
+    assert [r['status'] for r in body['results']] == ['success'] * 3 + ['error'] * 3
+    assert db.users.find_one({'_id': user_id})['points'] == 30
+    assert [type(doc['count']) for doc in db.sample_stats.find()] == [int] * 3
+
+def test_bulk_ratings_look_up_unknown_samples_once(db, login, counter, make_user, make_samples):
+    from bson import ObjectId
+
+    user_id = make_user()
+    make_samples(1)
+    playmaker_id = make_user('playmaker', is_playmaker=True)
+    items = [{'user_id': str(user_id), 'sample_id': str(ObjectId()), 'rating': 5} for _ in range(20)]
+    client = login(playmaker_id)
+    client.get('/dashboard')
+
+    counter.clear()
+    body = client.post('/api/ratings/bulk', json={'ratings': items}).get_json()
+
+    assert [r['message'] for r in body['results']] == ['Sample not found'] * 20
+    assert [c for c, name in zip(counter.commands, counter.collections) if name == 'samples'] == ['find']
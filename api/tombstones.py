@@ -0,0 +1,53 @@
+# Deleted users and samples are first tombstoned: marked with deleted_at so
+# every read skips them at once, while a background job (api/jobs.py)
+# removes their ratings in batches and then the document itself.
+import logging
+import threading
+import time
+
+from . import mongo
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+NOT_DELETED = {'deleted_at': {'$exists': False}}
+DELETED = {'deleted_at': {'$exists': True}}
+
+class Tombstones:
+    # Ids of the users and samples still being purged, so rating queries can
+    # leave out their remaining ratings. There are only ever a few, and the
+    # sparse deleted_at indexes make the reload cheap.
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._ids = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        return {
+            name: [doc['_id'] for doc in mongo.db[name].find(DELETED, {'_id': 1})]
+            for name in ('users', 'samples')
+        }
+
+    def get(self):
+        with self._lock:
+            if self._ids is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._ids = self._load()
+                self._loaded_at = time.monotonic()
+            return self._ids
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = None
+
+    def visible_ratings(self, query):
+        # Adds the tombstoned parents to a ratings query as $nin filters
+        ids = self.get()
+        query = dict(query)
+        if ids['users'] and 'user_id' not in query:
+            query['user_id'] = {'$nin': ids['users']}
+        if ids['samples'] and 'sample_id' not in query:
+            query['sample_id'] = {'$nin': ids['samples']}
+        return query
+
+tombstones = Tombstones(Config.TOMBSTONE_CACHE_TTL)
@@ -1,3 +1,4 @@
+from datetime import datetime
 from bson import ObjectId
 
 def validate_object_id(id_str):
@@ -7,8 +8,36 @@ def validate_object_id(id_str):
         return None
 
 def validate_rating(rating):
+    # JSON true/false would otherwise pass as 1 and 0
+    if isinstance(rating, bool):
+        return False
     try:
         rating = float(rating)
         return 0 <= rating <= 10
     except:
-        return False 
\ No newline at end of file
+        return False 
+
+def calculate_points(playmaker_rating, rating_value):
+    # Maximum 10 points for an exact match, two points lost per unit of difference
+    difference = abs(playmaker_rating - rating_value)
+    return max(0, 10 - int(difference * 2))
+
+def serialize_doc(value):
+    # Make Mongo documents safe for jsonify
+    if isinstance(value, dict):
+        return {k: serialize_doc(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [serialize_doc(v) for v in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def parse_page_args(args, default_size, max_size):
+    before = validate_object_id(args.get('before')) if args.get('before') else None
+    try:
+        limit = int(args.get('limit', default_size))
+    except (TypeError, ValueError):
+        limit = default_size
+    return before, max(1, min(limit, max_size))
\ No newline at end of file
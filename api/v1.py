@@ -0,0 +1,164 @@
+# Versioned JSON read API. Responses carry an ETag built from the version
+# counters of the collections they read, so a matching If-None-Match is
+# answered with 304 before any query runs. Responses served from a worker's
+# in-process caches (samples, leaderboard) are tagged with a hash of their
+# body instead, since those caches can lag the counters.
+import hashlib
+import json
+
+from flask import request, jsonify, Response
+from flask_login import current_user
+from bson import ObjectId
+
+from . import app, mongo
+from .catalog import catalog
+from .config import Config
+from .index import get_ratings_page
+from .leaderboard import leaderboard
+from .queries import own_ratings_page_pipeline, split_page
+from .utils import serialize_doc, parse_page_args, validate_object_id
+from .versions import versions
+from .tombstones import tombstones, NOT_DELETED
+
+def conditional_json(etag, build, public=False):
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    # Caches may keep the response but must revalidate it with us, which is
+    # cheap. Private responses depend on the session cookie.
+    response.headers['Cache-Control'] = f"{'public' if public else 'private'}, no-cache"
+    if not public:
+        response.vary.add('Cookie')
+    return response
+
+def cached_json(scope, body, public=False):
+    # The body costs no query, so it is built even for a 304, and a stale
+    # cache can never be served under a newer version's tag
+    digest = hashlib.sha1(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return conditional_json(f'{scope}-{digest}', lambda: body, public)
+
+def unauthorized():
+    return jsonify({'status': 'error', 'message': 'Login required'}), 401
+
+def forbidden(message):
+    return jsonify({'status': 'error', 'message': message}), 403
+
+def public_sample(sample):
+    # Players must not see the playmaker's rating before they rate
+    if current_user.is_playmaker:
+        return sample
+    return {k: v for k, v in sample.items() if k != 'playmaker_rating'}
+
+@app.route('/api/v1/samples')
+def api_samples():
+    if not current_user.is_authenticated:
+        return unauthorized()
+    role = 'playmaker' if current_user.is_playmaker else 'player'
+    return cached_json(
+        f'samples-{role}',
+        {'status': 'success', 'items': serialize_doc([public_sample(s) for s in catalog.all()])}
+    )
+
+def get_own_ratings_page(user_id, before, limit):
+    docs = catalog.attach(mongo.db.ratings.aggregate(own_ratings_page_pipeline(user_id, before, limit)))
+    return split_page(docs, limit)
+
+@app.route('/api/v1/ratings')
+def api_ratings():
+    # Playmakers page through every rating, players through their own
+    if not current_user.is_authenticated:
+        return unauthorized()
+    before, limit = parse_page_args(request.args, Config.DASHBOARD_PAGE_SIZE, Config.MAX_PAGE_SIZE)
+    scope = 'playmaker' if current_user.is_playmaker else current_user.id
+
+    def build():
+        if current_user.is_playmaker:
+            items, next_cursor = get_ratings_page(before, limit)
+        else:
+            items, next_cursor = get_own_ratings_page(ObjectId(current_user.id), before, limit)
+        return {'status': 'success', 'items': serialize_doc(items), 'next': next_cursor}
+
+    return conditional_json(versions.etag('ratings', 'users', 'samples', scope=scope), build)
+
+@app.route('/api/v1/leaderboard')
+def api_leaderboard():
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 100))
+    except ValueError:
+        limit = 10
+    return cached_json(
+        f'leaderboard-{limit}',
+        {'status': 'success', 'items': leaderboard.top(limit)},
+        public=True
+    )
+
+USER_STATS_FIELDS = {'username': 1, 'points': 1, 'is_playmaker': 1}
+
+def user_totals_pipeline(user_id):
+    return [
+        {'$match': tombstones.visible_ratings({'user_id': user_id})},
+        {'$group': {
+            '_id': None,
+            'count': {'$sum': 1},
+            'average_rating': {'$avg': '$rating_value'},
+            'average_points': {'$avg': '$points_earned'}
+        }}
+    ]
+
+def user_stats(user_id, user, totals):
+    if not user:
+        return {'status': 'error', 'message': 'User not found'}
+    summary = totals[0] if totals else {'count': 0, 'average_rating': None, 'average_points': None}
+    points = user.get('points', 0)
+    return {
+        'status': 'success',
+        'user': {
+            'id': user_id,
+            'username': user.get('username'),
+            'points': points,
+            'rank': None if user.get('is_playmaker') else leaderboard.rank(points),
+            'ratings': summary['count'],
+            'average_rating': summary['average_rating'],
+            'average_points': summary['average_points']
+        }
+    }
+
+@app.route('/api/v1/users/<user_id>/stats')
+def api_user_stats(user_id):
+    if not current_user.is_authenticated:
+        return unauthorized()
+    if user_id != current_user.id and not current_user.is_playmaker:
+        return forbidden('Players can only view their own stats')
+    user_obj_id = validate_object_id(user_id)
+    if not user_obj_id:
+        return jsonify({'status': 'error', 'message': 'Invalid user id'}), 400
+
+    def build():
+        user = mongo.db.users.find_one({'_id': user_obj_id, **NOT_DELETED}, USER_STATS_FIELDS)
+        totals = list(mongo.db.ratings.aggregate(user_totals_pipeline(user_obj_id)))
+        return user_stats(user_id, user, totals)
+
+    return conditional_json(versions.etag('users', 'ratings', scope=user_id), build)
+
+@app.route('/api/v1/analytics')
+def api_analytics():
+    # Rater accuracy report for playmakers. NumPy is optional, so the
+    # analytics module is only imported here.
+    if not current_user.is_authenticated:
+        return unauthorized()
+    if not current_user.is_playmaker:
+        return forbidden('Only playmakers can view analytics')
+    try:
+        from . import analytics
+    except ImportError:
+        return jsonify({'status': 'error', 'message': 'Analytics needs numpy installed'}), 501
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 1000))
+    except ValueError:
+        limit = 50
+    return conditional_json(
+        versions.etag('ratings', 'samples', 'users', scope=f'analytics-{limit}'),
+        lambda: dict(analytics.report(limit), status='success')
+    )
@@ -0,0 +1,62 @@
+import logging
+import threading
+import time
+
+from pymongo import ReturnDocument
+
+from . import mongo
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+class CollectionVersions:
+    # Change counters per collection, shared by all workers through one
+    # document in the meta collection. Every write bumps the counters of the
+    # collections it touched; readers build ETags from them. Reads use a
+    # copy cached for ttl seconds, so answering If-None-Match usually costs
+    # no query at all.
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._versions = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        doc = mongo.db.meta.find_one({'_id': 'versions'}) or {}
+        doc.pop('_id', None)
+        return doc
+
+    def get(self, *collections):
+        with self._lock:
+            if self._versions is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._versions = self._load()
+                self._loaded_at = time.monotonic()
+            return tuple(self._versions.get(name, 0) for name in collections)
+
+    def bump(self, *collections):
+        try:
+            doc = mongo.db.meta.find_one_and_update(
+                {'_id': 'versions'},
+                {'$inc': {name: 1 for name in collections}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            doc.pop('_id', None)
+            with self._lock:
+                self._versions = doc
+                self._loaded_at = time.monotonic()
+        except Exception as e:
+            # Worst case clients refetch unchanged data, so never fail the write
+            logger.error(f"Error bumping collection versions: {str(e)}")
+            with self._lock:
+                self._versions = None
+
+    def invalidate(self):
+        with self._lock:
+            self._versions = None
+
+    def etag(self, *collections, scope=''):
+        versions = '.'.join(str(v) for v in self.get(*collections))
+        return f"{'-'.join(collections)}-{versions}{'-' + scope if scope else ''}"
+
+versions = CollectionVersions(Config.VERSION_CACHE_TTL)
@@ -0,0 +1,138 @@
+# Concurrency per worker: the same read routes served by the WSGI app on a
+# fixed number of threads (one, like a sync gunicorn worker) and by the
+# ASGI app (api/asgi.py) on a single event loop, both driven in process
+# with the same number of requests in flight. Needs the async mode's
+# packages and a local mongod, since Motor can't talk to mongomock:
+#
+#   BENCH_MONGODB_URI=mongodb://localhost:27017/rating_meter_bench \
+#       python benchmarks/bench_async.py --concurrency 32 --requests 500
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_routes import BENCH_URI, PASSWORD, seed, percentile
+
+SCENARIOS = ('player_dashboard', 'playmaker_dashboard', 'api_ratings')
+
+def summarize(latencies, wall):
+    latencies = sorted(latencies)
+    return {
+        'throughput': len(latencies) / wall,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99)
+    }
+
+def targets(scenario, playmaker_id, player_ids, count):
+    # (path, user_id) for each request
+    if scenario == 'player_dashboard':
+        return [('/dashboard', player_ids[i % len(player_ids)]) for i in range(count)]
+    if scenario == 'playmaker_dashboard':
+        return [('/dashboard', playmaker_id)] * count
+    if scenario == 'api_ratings':
+        return [('/api/v1/ratings', player_ids[i % len(player_ids)]) for i in range(count)]
+    raise SystemExit(f"Unknown scenario {scenario}")
+
+def run_wsgi(app, cookies, requests, threads):
+    def get(target):
+        path, user_id = target
+        client = app.test_client()
+        client.set_cookie('localhost', app.session_cookie_name, cookies[user_id])
+        started = time.perf_counter()
+        response = client.get(path)
+        assert response.status_code == 200, response.status_code
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(get, requests))
+    return summarize(latencies, time.perf_counter() - started)
+
+async def asgi_get(application, path, cookie):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80)
+    }
+    status = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+async def run_asgi(application, cookies, requests, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def get(target):
+        path, user_id = target
+        async with slots:
+            started = time.perf_counter()
+            status = await asgi_get(application, path, f'session={cookies[user_id]}')
+            assert status == 200, status
+            return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*[get(target) for target in requests])
+    return summarize(latencies, time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=500)
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--ratings-per-player', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=300, help='requests per scenario and mode')
+    parser.add_argument('--concurrency', type=int, default=16, help='requests in flight')
+    parser.add_argument('--threads', type=int, default=1, help='WSGI worker threads')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    args = parser.parse_args()
+    random.seed(0)
+
+    os.environ['MONGODB_URI'] = BENCH_URI
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from api import app, mongo
+    from api.asgi import application
+    from api.migrate import setup_mongodb_indexes
+    from api.passwords import hasher
+    from api import stats
+
+    setup_mongodb_indexes()
+    playmaker_id, player_ids, _ = seed(mongo.db, args.players, args.samples, args.ratings_per_player,
+                                       hasher.hash(PASSWORD))
+    stats.rebuild()
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookies = {user_id: serializer.dumps({'_user_id': str(user_id), '_fresh': True})
+               for user_id in [playmaker_id] + list(player_ids)}
+
+    loop = asyncio.new_event_loop()
+    print(f"{args.requests} requests per run, {args.concurrency} in flight, "
+          f"WSGI on {args.threads} thread(s), ASGI on one event loop")
+    print(f"{'scenario':<22}{'mode':<6}{'req/s':>9}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}")
+    for scenario in args.scenarios.split(','):
+        requests = targets(scenario, playmaker_id, player_ids, args.requests)
+        # Warm the caches and the Motor pool before timing
+        run_wsgi(app, cookies, requests[:args.threads], args.threads)
+        loop.run_until_complete(run_asgi(application, cookies, requests[:args.concurrency], args.concurrency))
+
+        results = {
+            # A WSGI worker can only have as many requests in flight as it has threads
+            'wsgi': run_wsgi(app, cookies, requests, args.threads),
+            'asgi': loop.run_until_complete(run_asgi(application, cookies, requests, args.concurrency))
+        }
+        for mode, result in results.items():
+            print(f"{scenario:<22}{mode:<6}{result['throughput']:>9.1f}{result['p50_ms']:>11.2f}"
+                  f"{result['p95_ms']:>11.2f}{result['p99_ms']:>11.2f}")
+    loop.close()
+
+if __name__ == '__main__':
+    main()
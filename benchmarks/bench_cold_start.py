@@ -0,0 +1,54 @@
+# Measures serverless cold start: a fresh interpreter importing the app and
+# serving its first response. Each run is a new process, like a new lambda.
+#
+#   python benchmarks/bench_cold_start.py --runs 10 --path /api/test
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+from api import app
+imported = time.perf_counter()
+response = app.test_client().get(sys.argv[1])
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_response_ms': (served - imported) * 1000,
+    'total_ms': (served - start) * 1000,
+    'status': response.status_code
+}))
+'''
+
+def run_once(path, env):
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, path],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/api/test', help='route to request after import')
+    parser.add_argument('--eager', action='store_true', help='connect and ping at import (MONGO_LAZY_CONNECT=false)')
+    args = parser.parse_args()
+
+    env = dict(os.environ, MONGO_LAZY_CONNECT='false' if args.eager else 'true')
+    results = [run_once(args.path, env) for _ in range(args.runs)]
+
+    print(f"{args.runs} cold starts of {args.path} ({'eager' if args.eager else 'lazy'} connect), "
+          f"status {results[-1]['status']}")
+    print(f"{'phase':<20}{'median (ms)':>14}{'max (ms)':>12}")
+    for key in ('import_ms', 'first_response_ms', 'total_ms'):
+        values = [result[key] for result in results]
+        print(f"{key[:-3]:<20}{statistics.median(values):>14.1f}{max(values):>12.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# Compares the in-process leaderboard with the count_documents rank query
+# it replaced. Seeds a scratch database, so point BENCH_MONGODB_URI at a
+# local mongod, never at production.
+#
+#   python benchmarks/bench_leaderboard.py --players 50000 --lookups 500
+import argparse
+from datetime import datetime
+import os
+import random
+import sys
+import time
+
+from pymongo import MongoClient
+
+BENCH_URI = os.environ.get('BENCH_MONGODB_URI', 'mongodb://localhost:27017/rating_meter_bench')
+os.environ['MONGODB_URI'] = BENCH_URI
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from api.leaderboard import Leaderboard
+
+def seed(db, players):
+    db.users.drop()
+    now = datetime.utcnow()
+    db.users.insert_many([
+        {'username': f'player{i}', 'password_hash': '', 'is_playmaker': False,
+         'points': random.randint(0, 500), 'created_at': now}
+        for i in range(players)
+    ])
+    db.users.create_index([('points', -1)])
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=20000)
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    db = MongoClient(BENCH_URI).get_database()
+    seed(db, args.players)
+    probes = [random.randint(0, 500) for _ in range(args.lookups)]
+
+    board = Leaderboard(lambda: db.users.find({'is_playmaker': False}, {'username': 1, 'points': 1}), 3600)
+    start = time.perf_counter()
+    board.load(board.loader())
+    load_ms = (time.perf_counter() - start) * 1000
+
+    probe = iter(probes * 2)
+    count_rank = timed(lambda: db.users.count_documents({'points': {'$gt': next(probe)}, 'is_playmaker': False}) + 1, args.lookups)
+    probe = iter(probes * 2)
+    board_rank = timed(lambda: board.rank(next(probe)), args.lookups)
+    query_top = timed(lambda: list(db.users.find({'is_playmaker': False}).sort('points', -1).limit(10)), args.lookups)
+    board_top = timed(lambda: board.top(10), args.lookups)
+
+    print(f"players: {args.players}, lookups: {args.lookups}, initial load: {load_ms:.1f} ms")
+    print(f"{'operation':<12}{'mongo (ms)':>14}{'in-process (ms)':>18}")
+    print(f"{'rank':<12}{count_rank:>14.3f}{board_rank:>18.4f}")
+    print(f"{'top 10':<12}{query_top:>14.3f}{board_top:>18.4f}")
+
+if __name__ == '__main__':
+    main()
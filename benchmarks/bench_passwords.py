@@ -0,0 +1,74 @@
+# Login throughput at a given password hashing cost. Seeds players in a
+# scratch database, then logs them in through the Flask app from several
+# client threads at once. Point BENCH_MONGODB_URI at a local mongod, never at
+# production.
+#
+#   python benchmarks/bench_passwords.py --method pbkdf2:sha256:260000 --clients 8 --logins 200
+import argparse
+from datetime import datetime
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import MongoClient
+
+BENCH_URI = os.environ.get('BENCH_MONGODB_URI', 'mongodb://localhost:27017/rating_meter_bench')
+PASSWORD = 'correct horse battery staple'
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', default=os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+                        help='hashing threads (PASSWORD_HASH_WORKERS)')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent login requests')
+    parser.add_argument('--logins', type=int, default=100)
+    return parser.parse_args()
+
+def seed(db, players, password_hash):
+    db.users.drop()
+    now = datetime.utcnow()
+    db.users.insert_many([
+        {'username': f'player{i}', 'password_hash': password_hash, 'is_playmaker': False,
+         'points': 0, 'created_at': now}
+        for i in range(players)
+    ])
+    db.users.create_index('username', unique=True)
+
+def main():
+    args = parse_args()
+    # The app reads its settings at import
+    os.environ['MONGODB_URI'] = BENCH_URI
+    os.environ['PASSWORD_HASH_METHOD'] = args.method
+    os.environ['PASSWORD_HASH_WORKERS'] = str(args.workers)
+    os.environ['PASSWORD_HASH_QUEUE'] = str(args.clients)
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from api import app
+    from api.passwords import hasher
+
+    start = time.perf_counter()
+    password_hash = hasher.hash(PASSWORD)
+    hash_ms = (time.perf_counter() - start) * 1000
+    seed(MongoClient(BENCH_URI).get_database(), args.clients, password_hash)
+
+    def login(i):
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.post('/login', data={'username': f'player{i % args.clients}', 'password': PASSWORD})
+        assert response.status_code == 302, response.status_code
+        return (time.perf_counter() - started) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        latencies = sorted(pool.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - start
+
+    print(f"method {hasher.method}, {args.workers} hashing threads, {args.clients} clients, "
+          f"one hash {hash_ms:.1f} ms")
+    print(f"{args.logins} logins in {elapsed:.2f} s: {args.logins / elapsed:.1f} logins/s")
+    print(f"latency median {statistics.median(latencies):.1f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} ms, max {latencies[-1]:.1f} ms")
+
+if __name__ == '__main__':
+    main()
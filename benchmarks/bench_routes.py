@@ -0,0 +1,262 @@
+# Load test for the hot routes. Seeds players, samples and ratings, then
+# drives the Flask app from several client threads and reports latency
+# percentiles and MongoDB queries per request for each scenario. Run it
+# before and after a change to api/index.py and compare.
+#
+# Against a scratch database on a local mongod (never production):
+#
+#   BENCH_MONGODB_URI=mongodb://localhost:27017/rating_meter_bench \
+#       python benchmarks/bench_routes.py --players 2000 --samples 200 --requests 500
+#
+# Or entirely in memory, with mongomock installed:
+#
+#   python benchmarks/bench_routes.py --mongomock
+#
+# mongomock has no query planner or network, so use it to compare query
+# counts and Python overhead, and a real mongod for latency.
+import argparse
+from datetime import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import monitoring
+
+BENCH_URI = os.environ.get('BENCH_MONGODB_URI', 'mongodb://localhost:27017/rating_meter_bench')
+PASSWORD = 'benchmark'
+SCENARIOS = ('leaderboard', 'player_dashboard', 'playmaker_dashboard', 'rate_sample', 'login')
+
+# Queries issued by the current thread, so concurrent requests are counted
+# separately
+counts = threading.local()
+
+def count_query():
+    counts.queries = getattr(counts, 'queries', 0) + 1
+
+class QueryCounter(monitoring.CommandListener):
+    def started(self, event):
+        count_query()
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+COUNTED_METHODS = (
+    'find', 'find_one', 'aggregate', 'count_documents', 'estimated_document_count', 'distinct',
+    'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'bulk_write',
+    'delete_one', 'delete_many', 'find_one_and_update', 'find_one_and_delete'
+)
+
+def use_mongomock():
+    # mongomock sends no command events, so count calls on its collections.
+    # Only the outermost call counts: find_one is built on find.
+    import flask_pymongo
+    import mongomock
+
+    flask_pymongo.MongoClient = mongomock.MongoClient
+
+    def counted(method):
+        def wrapper(self, *args, **kwargs):
+            depth = getattr(counts, 'depth', 0)
+            if depth == 0:
+                count_query()
+            counts.depth = depth + 1
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                counts.depth = depth
+        return wrapper
+
+    for name in COUNTED_METHODS:
+        setattr(mongomock.Collection, name, counted(getattr(mongomock.Collection, name)))
+
+def seed(db, players, samples, ratings_per_player, password_hash):
+    from api.utils import calculate_points
+
+    for name in ('users', 'samples', 'ratings', 'sample_stats', 'meta'):
+        db[name].delete_many({})
+    now = datetime.utcnow()
+    sample_ids = db.samples.insert_many([
+        {'name': f'sample{i}', 'description': f'Benchmark sample {i}',
+         'playmaker_rating': round(random.uniform(0, 10), 1), 'created_at': now}
+        for i in range(samples)
+    ]).inserted_ids
+    sample_ratings = {s['_id']: s['playmaker_rating'] for s in db.samples.find({}, {'playmaker_rating': 1})}
+
+    playmaker_id = db.users.insert_one({
+        'username': 'playmaker', 'password_hash': password_hash, 'is_playmaker': True,
+        'points': 0, 'created_at': now
+    }).inserted_id
+    player_ids = db.users.insert_many([
+        {'username': f'player{i}', 'password_hash': password_hash, 'is_playmaker': False,
+         'points': 0, 'created_at': now}
+        for i in range(players)
+    ]).inserted_ids
+
+    # Each player has rated the first ratings_per_player samples, which
+    # leaves the rest for the rate_sample scenario
+    points = {}
+    batch = []
+    for player_id in player_ids:
+        for sample_id in sample_ids[:ratings_per_player]:
+            rating_value = round(random.uniform(0, 10), 1)
+            earned = calculate_points(sample_ratings[sample_id], rating_value)
+            points[player_id] = points.get(player_id, 0) + earned
+            batch.append({'user_id': player_id, 'sample_id': sample_id, 'rating_value': rating_value,
+                          'points_earned': earned, 'created_at': now})
+            if len(batch) >= 10000:
+                db.ratings.insert_many(batch)
+                batch = []
+    if batch:
+        db.ratings.insert_many(batch)
+    for player_id, total in points.items():
+        db.users.update_one({'_id': player_id}, {'$set': {'points': total}})
+
+    return playmaker_id, player_ids, sample_ids[ratings_per_player:]
+
+def percentile(values, p):
+    # Nearest rank on already sorted values
+    index = max(0, int(round(p / 100 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+def flashed(client):
+    # Pops the messages flashed to this client's session
+    with client.session_transaction() as sess:
+        return [message for _, message in sess.pop('_flashes', [])]
+
+def succeeded(scenario, response, client):
+    # The form routes redirect or re-render with a flashed message whether
+    # or not they worked, so the status code alone doesn't tell
+    if scenario == 'rate_sample':
+        return response.status_code == 302 and any(m.startswith('Rating submitted') for m in flashed(client))
+    if scenario == 'login':
+        return response.status_code == 302 and response.location.endswith('/dashboard')
+    return response.status_code < 400
+
+def make_requests(app, scenario, playmaker_id, player_ids, unrated_ids, count):
+    # Returns one zero-argument callable per request, built up front so the
+    # timed section only contains the request itself. Each returns the
+    # response and the client that sent it.
+    def session(user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+        return client
+
+    if scenario == 'leaderboard':
+        client = app.test_client()
+        return [lambda: (client.get('/leaderboard'), client) for _ in range(count)]
+    if scenario == 'player_dashboard':
+        clients = [session(player_ids[i % len(player_ids)]) for i in range(min(count, len(player_ids)))]
+        return [lambda c=clients[i % len(clients)]: (c.get('/dashboard'), c) for i in range(count)]
+    if scenario == 'playmaker_dashboard':
+        client = session(playmaker_id)
+        return [lambda: (client.get('/dashboard'), client) for _ in range(count)]
+    if scenario == 'rate_sample':
+        # Distinct (player, sample) pairs so no rating is a duplicate
+        pairs = [(player_id, sample_id) for sample_id in unrated_ids for player_id in player_ids][:count]
+        if len(pairs) < count:
+            raise SystemExit(f"Only {len(pairs)} unrated pairs for {count} rate_sample requests, "
+                             "seed more samples or players")
+        clients = {player_id: session(player_id) for player_id, _ in pairs}
+        return [
+            lambda c=clients[player_id], s=sample_id: (c.post(f'/rate_sample/{s}', data={'rating': '5'}), c)
+            for player_id, sample_id in pairs
+        ]
+    if scenario == 'login':
+        clients = [app.test_client() for _ in range(count)]
+        return [
+            lambda i=i: (clients[i].post('/login', data={
+                'username': f'player{i % len(player_ids)}', 'password': PASSWORD
+            }), clients[i])
+            for i in range(count)
+        ]
+    raise SystemExit(f"Unknown scenario {scenario}")
+
+def run_scenario(scenario, requests, clients):
+    def timed(send):
+        counts.queries = 0
+        started = time.perf_counter()
+        response, client = send()
+        elapsed = (time.perf_counter() - started) * 1000
+        return elapsed, counts.queries, succeeded(scenario, response, client)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(timed, requests))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(result[0] for result in results)
+    return {
+        'requests': len(results),
+        'throughput': len(results) / wall,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'queries_per_request': sum(result[1] for result in results) / len(results),
+        'errors': sum(1 for result in results if not result[2])
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mongomock', action='store_true', help='run in memory instead of against BENCH_MONGODB_URI')
+    parser.add_argument('--players', type=int, default=500)
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--ratings-per-player', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--clients', type=int, default=4, help='concurrent client threads')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated subset of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the generated data')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # Everything below must be in place before the app creates its client
+    os.environ['MONGODB_URI'] = BENCH_URI
+    if args.mongomock:
+        use_mongomock()
+    else:
+        monitoring.register(QueryCounter())
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    from api import app, mongo
+    from api.migrate import setup_mongodb_indexes
+    from api.passwords import hasher
+    from api import stats
+
+    setup_mongodb_indexes()
+    started = time.perf_counter()
+    playmaker_id, player_ids, unrated_ids = seed(
+        mongo.db, args.players, args.samples, args.ratings_per_player, hasher.hash(PASSWORD)
+    )
+    stats.rebuild()
+    print(f"Seeded {args.players} players, {args.samples} samples and "
+          f"{args.players * args.ratings_per_player} ratings in {time.perf_counter() - started:.1f} s "
+          f"({'mongomock' if args.mongomock else BENCH_URI})")
+
+    results = {}
+    for scenario in args.scenarios.split(','):
+        requests = make_requests(app, scenario, playmaker_id, player_ids, unrated_ids, args.requests + 1)
+        # The first request warms the in-process caches and isn't timed
+        _, client = requests.pop(0)()
+        flashed(client)
+        results[scenario] = run_scenario(scenario, requests, args.clients)
+
+    print(f"{args.clients} clients, {args.requests} requests per scenario")
+    print(f"{'scenario':<22}{'req/s':>9}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}{'queries':>10}{'errors':>8}")
+    for scenario, result in results.items():
+        print(f"{scenario:<22}{result['throughput']:>9.1f}{result['p50_ms']:>11.2f}{result['p95_ms']:>11.2f}"
+              f"{result['p99_ms']:>11.2f}{result['queries_per_request']:>10.1f}{result['errors']:>8}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+
+# Tests that need MongoDB run against a throwaway local database, never the
+# one in MONGODB_URI, and are skipped when it isn't reachable
+TEST_URI = os.environ.get('TEST_MONGODB_URI', 'mongodb://localhost:27017/rating_meter_test')
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+        self.collections = []
+
+    def started(self, event):
+        self.commands.append(event.command_name)
+        self.collections.append(event.command.get(event.command_name))
+
+    def clear(self):
+        self.commands.clear()
+        self.collections.clear()
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+command_counter = CommandCounter()
+monitoring.register(command_counter)
+
+def mongo_available():
+    try:
+        MongoClient(TEST_URI, serverSelectionTimeoutMS=1000).admin.command('ping')
+        return True
+    except PyMongoError:
+        return False
+
+MONGO_AVAILABLE = mongo_available()
+if MONGO_AVAILABLE:
+    os.environ['MONGODB_URI'] = TEST_URI
+
+def reset(mongo):
+    from api.catalog import catalog
+    from api.leaderboard import leaderboard
+    from api.models import user_cache
+    from api.versions import versions
+    from api.tombstones import tombstones
+
+    for name in ('users', 'samples', 'ratings', 'sample_stats', 'meta', 'jobs'):
+        mongo.db[name].delete_many({})
+    catalog.invalidate()
+    leaderboard.invalidate()
+    user_cache.clear()
+    versions.invalidate()
+    tombstones.invalidate()
+
+@pytest.fixture
+def app():
+    if not MONGO_AVAILABLE:
+        pytest.skip('local MongoDB not available')
+    from api import app
+    from api.migrate import setup_mongodb_indexes
+
+    setup_mongodb_indexes()
+    return app
+
+@pytest.fixture
+def db(app):
+    from api import mongo
+
+    reset(mongo)
+    yield mongo.db
+    reset(mongo)
+
+@pytest.fixture
+def clear(db):
+    from api import mongo
+
+    return lambda: reset(mongo)
+
+@pytest.fixture
+def counter():
+    return command_counter
+
+@pytest.fixture
+def login(app):
+    def login(user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+        return client
+    return login
@@ -1,10 +1,12 @@
 from pymongo import MongoClient
 import os
 
+from api.config import Config
+
 def test_mongodb():
     uri = "your_mongodb_uri_here"  # Replace with your connection string
     try:
-        client = MongoClient(uri)
+        client = MongoClient(uri, **Config.mongo_client_options())
         db = client.get_database()
         db.command('ping')
         print("MongoDB connection successful!")